@@ -1,6 +1,21 @@
 from django.apps import AppConfig
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.backends.signals import connection_created
+
+from components.config import config
+
+
+def apply_sqlite_pragmas(sender: type, connection: BaseDatabaseWrapper, **kwargs) -> None:
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in config.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
 
 
 class BackendDjangoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api_django'
+
+    def ready(self) -> None:
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid="api_django.apply_sqlite_pragmas")
@@ -2,7 +2,7 @@
 
 import json
 import logging
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future
 
 from channels.db import database_sync_to_async  # type: ignore
 from channels.exceptions import StopConsumer  # type: ignore
@@ -10,10 +10,11 @@ from channels.generic.websocket import AsyncJsonWebsocketConsumer  # type: ignor
 from django.contrib.auth.models import AnonymousUser
 
 from components.chat_data_processor import ChatDataProcessor
-from components.config import config
 from components.docker_interface import DockerManager
 from components.lang_model_service import LLMClient
+from components.resource_hub import resource_hub
 from .models import Conversation
+from .persistence import message_writer
 
 logger = logging.getLogger(__name__)
 
@@ -25,18 +26,19 @@ class GenerateConsumer(AsyncJsonWebsocketConsumer):
         self.llm_client = LLMClient()
         self.chat_data_processor: ChatDataProcessor | None = None
         self.conversation: Conversation | None = None
+        self.container_lease: Future | None = None
 
     async def connect(self) -> None:
         await self.accept()
-        config.reload()
-        executor = ThreadPoolExecutor()
-        executor.submit(self.docker_manager.start_container)
+        self.container_lease = resource_hub.long_running_executor.submit(self.docker_manager.start_container)
+        self.container_lease.add_done_callback(self._log_lease_failure)
 
-        self.chat_data_processor = ChatDataProcessor(self.docker_manager, self, self.llm_client)
+        self.chat_data_processor = ChatDataProcessor(
+            self.docker_manager, self, self.llm_client, message_sink=self.persist_message
+        )
 
     async def disconnect(self, close_code: int) -> None:
-        executor = ThreadPoolExecutor()
-        executor.submit(self.docker_manager.remove_container)
+        resource_hub.executor.submit(self.docker_manager.remove_container)
         raise StopConsumer()
 
     async def receive(self, text_data: str | None = None, bytes_data: bytes | None = None, **kwargs) -> None:
@@ -50,14 +52,20 @@ class GenerateConsumer(AsyncJsonWebsocketConsumer):
         if self.conversation is None:
             # noinspection PyUnresolvedReferences
             self.conversation = await self.create_conversation(model_name)
-        # else:
-        #     await self.conversation.save()
-        #     Message.objects.create(conversation=self.conversation, text=prompt_text, is_system=False)
 
         if not self.chat_data_processor:
             raise Exception("Chat data processor not initialized.")
         await self.chat_data_processor.process_prompt(prompt_text, model_name=model_name, test_input=test_input)
 
+    @staticmethod
+    def _log_lease_failure(container_lease: Future) -> None:
+        if not container_lease.cancelled() and container_lease.exception() is not None:
+            logger.error(f"Failed to lease a sandbox container: {container_lease.exception()}")
+
+    def persist_message(self, role: str, text: str, token_count: int | None = None) -> None:
+        if self.conversation is not None:
+            message_writer.write(self.conversation.id, role, text, token_count)
+
     async def send(self, text_data: str | None = None, bytes_data: bytes | None = None, close: bool = False) -> None:
         pass
 
@@ -0,0 +1,62 @@
+# benchmark_database.py
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+from django.db import DatabaseError, connections
+from django.utils import timezone
+
+from api_django.models import Conversation, Message
+from components.config import config
+
+BENCHMARK_MODEL_NAME = "benchmark_database"
+
+
+class Command(BaseCommand):
+    help = "Compare conversation-create and message-insert throughput of the configured database backends."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--database", action="append", choices=list(settings.DATABASE_BACKENDS))
+        parser.add_argument("--conversations", type=int, default=200)
+        parser.add_argument("--messages", type=int, default=5000)
+
+    def handle(self, *args: object, **options: object) -> None:
+        if int(options["conversations"]) < 1 or int(options["messages"]) < 1:
+            raise CommandError("--conversations and --messages must be at least 1")
+        aliases = options["database"] or list(settings.DATABASE_BACKENDS)
+        for alias in aliases:
+            try:
+                self._benchmark(str(alias), int(options["conversations"]), int(options["messages"]))
+            except DatabaseError as e:
+                raise CommandError(f"{alias}: {e}. Run 'manage.py migrate --database {alias}' first?") from e
+            finally:
+                connections[alias].close()
+
+    def _benchmark(self, alias: str, conversation_count: int, message_count: int) -> None:
+        conversations = Conversation.objects.using(alias)
+        try:
+            # one row per call, like GenerateConsumer.create_conversation
+            start = perf_counter()
+            for _ in range(conversation_count):
+                conversation = conversations.create(gpt_model_name=BENCHMARK_MODEL_NAME)
+            create_rate = conversation_count / (perf_counter() - start)
+
+            # batches of the size the write-behind MessageWriter flushes
+            start = perf_counter()
+            batch_size = config.MESSAGE_WRITE_BATCH_SIZE
+            for offset in range(0, message_count, batch_size):
+                now = timezone.now()
+                Message.objects.using(alias).bulk_create(
+                    [
+                        Message(conversation=conversation, role=Message.ROLE_ASSISTANT, text="x" * 512, timestamp=now)
+                        for _ in range(min(batch_size, message_count - offset))
+                    ]
+                )
+            insert_rate = message_count / (perf_counter() - start)
+        finally:
+            conversations.filter(gpt_model_name=BENCHMARK_MODEL_NAME).delete()
+
+        self.stdout.write(
+            f"{alias}: {create_rate:.0f} conversation creates/s, "
+            f"{insert_rate:.0f} message inserts/s in batches of {batch_size}"
+        )
@@ -0,0 +1,68 @@
+# benchmark_ttft.py
+import asyncio
+import statistics
+from dataclasses import replace
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError, CommandParser
+
+from components.config import LLMApi, config
+from components.lang_model_service import LLMClient
+from components.model_server import model_server_supervisor
+from components.resource_hub import resource_hub
+
+
+class Command(BaseCommand):
+    help = "Measure time to first token of a local model with and without llama.cpp prompt caching."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("model_name")
+        parser.add_argument("--requests", type=int, default=5)
+        parser.add_argument("--max-tokens", type=int, default=16)
+        parser.add_argument("--prompt", default="Write a function that reverses a string.")
+
+    def handle(self, *args: object, **options: object) -> None:
+        model_name = str(options["model_name"])
+        llm_api = config.LLM_APIS.get(model_name)
+        if llm_api is None or not llm_api.local:
+            raise CommandError(f"{model_name} is not a local model")
+        asyncio.run(self._benchmark(model_name, options))
+
+    async def _benchmark(self, model_name: str, options: dict) -> None:
+        try:
+            async with model_server_supervisor.lease(model_name) as url:
+                llm_api = replace(config.LLM_APIS[model_name], url=url)
+                for cache_prompt in (False, True):
+                    timings = [
+                        await self._time_to_first_token(llm_api, model_name, cache_prompt, options)
+                        for _ in range(int(options["requests"]))
+                    ]
+                    # the first cached request still has to fill the slot, so report it apart from the rest
+                    self.stdout.write(
+                        f"cache_prompt={cache_prompt}: first {timings[0] * 1000:.0f} ms, "
+                        f"median {statistics.median(timings) * 1000:.0f} ms, "
+                        f"min {min(timings) * 1000:.0f} ms over {len(timings)} requests"
+                    )
+        finally:
+            # the server was started just for this run, so stop it even when a request fails
+            model_server_supervisor.stop()
+
+    @staticmethod
+    async def _time_to_first_token(llm_api: LLMApi, model_name: str, cache_prompt: bool, options: dict) -> float:
+        client = resource_hub.get_llm_client(llm_api)
+        start = perf_counter()
+        response = await client.chat.completions.create(
+            model=model_name,
+            messages=[
+                {"role": "system", "content": LLMClient.get_system_message()},
+                {"role": "user", "content": str(options["prompt"])},
+            ],
+            max_tokens=int(options["max_tokens"]),
+            stream=True,
+            **LLMClient.completion_options(llm_api, cache_prompt),
+        )
+        first_token = None
+        async for chunk in response:
+            if first_token is None and chunk.choices and chunk.choices[0].delta.content:
+                first_token = perf_counter() - start
+        return first_token if first_token is not None else perf_counter() - start
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.1 on 2026-10-17 09:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api_django", "0004_rename_model_name_conversation_gpt_model_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="role",
+            field=models.CharField(
+                choices=[
+                    ("user", "User"),
+                    ("assistant", "Assistant"),
+                    ("execution", "Execution"),
+                    ("system", "System"),
+                ],
+                default="user",
+                max_length=16,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="message",
+            name="is_system",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name="message",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["conversation", "timestamp"], name="message_conversation_time_idx"),
+        ),
+    ]
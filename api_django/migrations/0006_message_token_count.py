@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-17 10:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("api_django", "0005_message_role_message_timestamp_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="message",
+            name="token_count",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -4,21 +4,45 @@ from django.db.models import (
     CASCADE,
     CharField,
     ForeignKey,
-    OneToOneField,
     TextField,
     DateTimeField,
     BooleanField,
+    Index,
+    PositiveIntegerField,
     Model,
 )
+from django.utils import timezone
 
 
 class Conversation(Model):
     gpt_model_name: CharField = CharField(max_length=255)
-    user: OneToOneField = OneToOneField(settings.AUTH_USER_MODEL, on_delete=CASCADE, null=True)
+    user: ForeignKey = ForeignKey(settings.AUTH_USER_MODEL, on_delete=CASCADE, null=True)
+    created_at: DateTimeField = DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [Index(fields=["user", "created_at"], name="conversation_user_created_idx")]
 
 
 class Message(Model):
+    ROLE_USER = "user"
+    ROLE_ASSISTANT = "assistant"
+    ROLE_EXECUTION = "execution"
+    ROLE_SYSTEM = "system"
+    ROLE_CHOICES = [
+        (ROLE_USER, "User"),
+        (ROLE_ASSISTANT, "Assistant"),
+        (ROLE_EXECUTION, "Execution"),
+        (ROLE_SYSTEM, "System"),
+    ]
+
     conversation: ForeignKey = ForeignKey(Conversation, on_delete=CASCADE)
+    role: CharField = CharField(max_length=16, choices=ROLE_CHOICES, default=ROLE_USER)
     text: TextField = TextField()
-    is_system: BooleanField = BooleanField()
-    timestamp: DateTimeField = DateTimeField(auto_now_add=True)
+    # counted with the tokenizer of the model the conversation was using when the message was written
+    token_count: PositiveIntegerField = PositiveIntegerField(null=True, blank=True)
+    is_system: BooleanField = BooleanField(default=False)
+    # set when the message is queued rather than when the write-behind batch reaches the database
+    timestamp: DateTimeField = DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [Index(fields=["conversation", "timestamp"], name="message_conversation_time_idx")]
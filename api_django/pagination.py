@@ -0,0 +1,68 @@
+# pagination.py
+import base64
+import json
+from datetime import datetime
+from typing import AsyncIterator, Callable
+
+from django.db.models import Model, Q, QuerySet
+
+from components.config import config
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp: datetime, row_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{row_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def page_size(value: str | None) -> int:
+    if not value:
+        return config.HISTORY_PAGE_SIZE
+    try:
+        return max(1, min(int(value), config.HISTORY_PAGE_MAX_SIZE))
+    except ValueError as e:
+        raise InvalidCursor(value) from e
+
+
+def keyset_page(
+    queryset: QuerySet, time_field: str, cursor: str | None, limit: int, descending: bool = False
+) -> QuerySet:
+    # Seek past the cursor on (time_field, id) instead of using OFFSET, so every page costs one index range scan
+    # no matter how deep into the history it is.
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        comparison = "lt" if descending else "gt"
+        queryset = queryset.filter(
+            Q(**{f"{time_field}__{comparison}": timestamp}) | Q(**{time_field: timestamp, f"id__{comparison}": row_id})
+        )
+    prefix = "-" if descending else ""
+    # one extra row tells whether there is a next page without a COUNT query
+    return queryset.order_by(f"{prefix}{time_field}", f"{prefix}id")[: limit + 1]
+
+
+async def stream_page(
+    key: str, page: QuerySet, time_field: str, limit: int, serialize: Callable[[Model], dict]
+) -> AsyncIterator[str]:
+    yield f"{{{json.dumps(key)}: ["
+    last_row = None
+    count = 0
+    next_cursor = None
+    async for row in page.aiterator(chunk_size=config.HISTORY_STREAM_CHUNK_SIZE):
+        if count == limit:
+            assert last_row is not None
+            next_cursor = encode_cursor(getattr(last_row, time_field), last_row.id)
+            break
+        yield ("," if count else "") + json.dumps(serialize(row))
+        last_row = row
+        count += 1
+    yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
@@ -0,0 +1,202 @@
+# persistence.py
+import asyncio
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from time import monotonic
+
+from channels.db import database_sync_to_async  # type: ignore
+from django.db import DatabaseError, IntegrityError
+from django.utils import timezone
+
+from components.config import config
+from .models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    def __init__(
+        self,
+        batch_size: int = config.MESSAGE_WRITE_BATCH_SIZE,
+        flush_interval: float = config.MESSAGE_WRITE_FLUSH_INTERVAL,
+        max_pending: int = config.MESSAGE_WRITE_QUEUE_SIZE,
+        overflow_policy: str = config.MESSAGE_WRITE_OVERFLOW_POLICY,
+        spill_file: Path = config.MESSAGE_SPILL_FILE,
+    ) -> None:
+        if overflow_policy not in ("drop", "spill"):
+            raise ValueError(f"Unknown message overflow policy {overflow_policy}")
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.overflow_policy = overflow_policy
+        self.spill_file = spill_file
+        self._queue: asyncio.Queue[Message] | None = None
+        self._worker: asyncio.Task | None = None
+        self._in_flight: list[Message] = []
+        self.written_total = 0
+        self.dropped_total = 0
+        self.spilled_total = 0
+
+    def metrics(self) -> dict[str, int]:
+        return {
+            "messages_pending": self._queue.qsize() if self._queue else 0,
+            "messages_written_total": self.written_total,
+            "messages_dropped_total": self.dropped_total,
+            "messages_spilled_total": self.spilled_total,
+        }
+
+    def write(self, conversation_id: int, role: str, text: str, token_count: int | None = None) -> None:
+        # never awaits, so a slow database cannot hold up the response stream
+        if not text:
+            return
+        message = Message(
+            conversation_id=conversation_id,
+            role=role,
+            text=text,
+            token_count=token_count,
+            is_system=role == Message.ROLE_SYSTEM,
+            timestamp=timezone.now(),
+        )
+        queue = self._ensure_worker()
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self._overflow([message])
+
+    def close(self) -> None:
+        # Runs from atexit once the event loop has stopped, so the worker cannot drain the queue any more. Write
+        # the batch it was collecting and what is left in the queue synchronously and fall back to the overflow
+        # policy; spilled messages are replayed on the next start.
+        self._worker = None
+        pending, self._in_flight = self._in_flight, []
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        if not pending:
+            return
+        try:
+            Message.objects.bulk_create(pending)
+        except DatabaseError as e:
+            logger.warning(f"Failed to write {len(pending)} messages at shutdown: {e}")
+            self._overflow(pending)
+            return
+        self.written_total += len(pending)
+        logger.info(f"Wrote {len(pending)} pending messages at shutdown.")
+
+    def _ensure_worker(self) -> asyncio.Queue[Message]:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run(self._queue))
+        return self._queue
+
+    async def _run(self, queue: asyncio.Queue[Message]) -> None:
+        await self._replay_spill()
+        while True:
+            # kept on self so that close() can still write it if the loop stops mid-batch
+            batch = self._in_flight = [await queue.get()]
+            deadline = monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._write_batch(batch)
+            self._in_flight = []
+
+    async def _write_batch(self, batch: list[Message]) -> None:
+        try:
+            await database_sync_to_async(Message.objects.bulk_create)(batch)
+        except IntegrityError as e:
+            # Usually a conversation that was deleted while its messages were queued or spilled. Retrying those
+            # would fail forever, so drop them and write the rest.
+            remaining = await database_sync_to_async(self._drop_orphans)(batch)
+            if len(remaining) < len(batch):
+                if remaining:
+                    await self._write_batch(remaining)
+                return
+            logger.warning(f"Failed to write {len(batch)} messages: {e}")
+            self._overflow(batch)
+            return
+        except DatabaseError as e:
+            logger.warning(f"Failed to write {len(batch)} messages: {e}")
+            self._overflow(batch)
+            return
+        self.written_total += len(batch)
+
+    def _drop_orphans(self, batch: list[Message]) -> list[Message]:
+        conversation_ids = {message.conversation_id for message in batch}
+        existing_ids = set(Conversation.objects.filter(id__in=conversation_ids).values_list("id", flat=True))
+        remaining = [message for message in batch if message.conversation_id in existing_ids]
+        if len(remaining) < len(batch):
+            self.dropped_total += len(batch) - len(remaining)
+            missing_ids = sorted(conversation_ids - existing_ids)
+            logger.warning(f"Dropped {len(batch) - len(remaining)} messages of deleted conversations {missing_ids}.")
+        for message in remaining:
+            # the failed insert may have assigned primary keys that were rolled back
+            message.pk = None
+            message._state.adding = True
+        return remaining
+
+    def _overflow(self, messages: list[Message]) -> None:
+        if self.overflow_policy == "drop":
+            self.dropped_total += len(messages)
+            logger.warning(f"Dropped {len(messages)} messages that could not be written.")
+            return
+        self._spill(messages)
+
+    def _spill(self, messages: list[Message]) -> bool:
+        try:
+            self.spill_file.parent.mkdir(parents=True, exist_ok=True)
+            with self.spill_file.open("a") as spill:
+                for message in messages:
+                    spill.write(json.dumps(self._to_record(message)) + "\n")
+        except OSError as e:
+            self.dropped_total += len(messages)
+            logger.warning(f"Failed to spill {len(messages)} messages to {self.spill_file}: {e}")
+            return False
+        self.spilled_total += len(messages)
+        return True
+
+    async def _replay_spill(self) -> None:
+        if not self.spill_file.exists():
+            return
+        replay_file = self.spill_file.with_suffix(".replay")
+        try:
+            self.spill_file.replace(replay_file)
+            messages = [self._from_record(json.loads(line)) for line in replay_file.read_text().splitlines() if line]
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read spilled messages from {self.spill_file}: {e}")
+            return
+        for start in range(0, len(messages), self.batch_size):
+            await self._write_batch(messages[start : start + self.batch_size])
+        replay_file.unlink(missing_ok=True)
+        logger.info(f"Replayed {len(messages)} spilled messages.")
+
+    @staticmethod
+    def _to_record(message: Message) -> dict:
+        return {
+            "conversation_id": message.conversation_id,
+            "role": message.role,
+            "text": message.text,
+            "token_count": message.token_count,
+            "timestamp": message.timestamp.isoformat(),
+        }
+
+    @staticmethod
+    def _from_record(record: dict) -> Message:
+        return Message(
+            conversation_id=record["conversation_id"],
+            role=record["role"],
+            text=record["text"],
+            token_count=record.get("token_count"),
+            is_system=record["role"] == Message.ROLE_SYSTEM,
+            timestamp=datetime.fromisoformat(record["timestamp"]),
+        )
+
+
+message_writer = MessageWriter()
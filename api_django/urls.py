@@ -3,4 +3,7 @@ from . import views
 
 urlpatterns = [
     path("gpt_models", views.get_gpt_models),
+    path("metrics", views.get_metrics),
+    path("conversations", views.list_conversations),
+    path("conversations/<int:conversation_id>/messages", views.list_messages),
 ]
@@ -1,7 +1,77 @@
-from django.http import JsonResponse, HttpRequest
-from components.lang_model_service import LLMClient
+from django.http import HttpRequest, JsonResponse, StreamingHttpResponse
+
+from api_django.models import Conversation, Message
+from api_django.pagination import InvalidCursor, keyset_page, page_size, stream_page
+from api_django.persistence import message_writer
+from components.config import config
+from components.exec_watchdog import exec_watchdog
+from components.host_router import host_router
+from components.model_server import model_server_supervisor
 
 
 def get_gpt_models(request: HttpRequest) -> JsonResponse:
-    gpt_model_names = list(LLMClient.get_model_names())
+    gpt_model_names = list(config.LLM_APIS)
     return JsonResponse({"gpt_models": gpt_model_names})
+
+
+def get_metrics(request: HttpRequest) -> JsonResponse:
+    metrics = {
+        **exec_watchdog.metrics(),
+        **model_server_supervisor.metrics(),
+        **host_router.metrics(),
+        **message_writer.metrics(),
+    }
+    return JsonResponse(metrics)
+
+
+async def list_conversations(request: HttpRequest) -> JsonResponse | StreamingHttpResponse:
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({"error": "Authentication required"}, status=401)
+    try:
+        limit = page_size(request.GET.get("limit"))
+        conversations = Conversation.objects.filter(user=user).only("id", "gpt_model_name", "created_at")
+        page = keyset_page(conversations, "created_at", request.GET.get("cursor"), limit, descending=True)
+    except InvalidCursor:
+        return JsonResponse({"error": "Invalid cursor or limit"}, status=400)
+    return StreamingHttpResponse(
+        stream_page("conversations", page, "created_at", limit, _serialize_conversation),
+        content_type="application/json",
+    )
+
+
+async def list_messages(request: HttpRequest, conversation_id: int) -> JsonResponse | StreamingHttpResponse:
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({"error": "Authentication required"}, status=401)
+    if not await Conversation.objects.filter(id=conversation_id, user=user).aexists():
+        return JsonResponse({"error": "Conversation not found"}, status=404)
+    try:
+        limit = page_size(request.GET.get("limit"))
+        messages = Message.objects.filter(conversation_id=conversation_id).only(
+            "id", "role", "text", "token_count", "timestamp"
+        )
+        page = keyset_page(messages, "timestamp", request.GET.get("cursor"), limit)
+    except InvalidCursor:
+        return JsonResponse({"error": "Invalid cursor or limit"}, status=400)
+    return StreamingHttpResponse(
+        stream_page("messages", page, "timestamp", limit, _serialize_message), content_type="application/json"
+    )
+
+
+def _serialize_conversation(conversation: Conversation) -> dict:
+    return {
+        "id": conversation.id,
+        "gpt_model_name": conversation.gpt_model_name,
+        "created_at": conversation.created_at.isoformat(),
+    }
+
+
+def _serialize_message(message: Message) -> dict:
+    return {
+        "id": message.id,
+        "role": message.role,
+        "text": message.text,
+        "token_count": message.token_count,
+        "timestamp": message.timestamp.isoformat(),
+    }
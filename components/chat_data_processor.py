@@ -1,88 +1,141 @@
 # data_processor.py
+import asyncio
 import logging
-from asyncio import sleep
-from pathlib import Path
+from contextlib import aclosing
+from functools import partial
+from typing import Callable
 
 from channels.generic.websocket import AsyncJsonWebsocketConsumer  # type: ignore
 
-from components.code_validation import CodeValidator
+from components.code_validation import CodeBlockParser
 from components.config import config
+from components.conversation_history import ROLE_ASSISTANT, ROLE_EXECUTION, ROLE_USER, ConversationHistory
 from components.docker_interface import DockerManager
 from components.lang_model_service import LLMClient
+from components.output_batcher import OutputBatcher
+from components.package_index import package_index
+from components.tokenization import token_counter
+from components.validation_service import validation_service
 
 logger = logging.getLogger(__name__)
 
+# called with the role, text and token count of every message that should be stored
+MessageSink = Callable[[str, str, int | None], None]
+
 
 class ChatDataProcessor:
     def __init__(
-        self, docker_manager: DockerManager, consumer: AsyncJsonWebsocketConsumer, llm_client: LLMClient
+        self,
+        docker_manager: DockerManager,
+        consumer: AsyncJsonWebsocketConsumer,
+        llm_client: LLMClient,
+        message_sink: MessageSink | None = None,
     ) -> None:
         self.docker_manager = docker_manager
         self.consumer = consumer
         self.llm_client = llm_client
+        self.message_sink = message_sink
+        self.code_output = OutputBatcher(consumer, "code")
+        self.history = ConversationHistory()
+        self._summary_task: asyncio.Task | None = None
 
     async def process_prompt(self, prompt_text: str, model_name: str, test_input: bool) -> None:
+        if model_name in config.LLM_APIS:
+            # everything below counts tokens on the event loop, which must not be where the tokenizer loads
+            await token_counter.load_async(model_name)
+        self.persist_message(ROLE_USER, prompt_text, self._count_tokens(prompt_text, model_name))
+        response_output = OutputBatcher(self.consumer, "response")
+        code_block_parser = CodeBlockParser()
+        code_blocks: asyncio.Queue[tuple[str | None, str] | None] = asyncio.Queue()
+        code_block_worker = asyncio.create_task(self.process_code_blocks(code_blocks))
+        try:
+            if test_input:
+                full_response = config.TEST_INPUT
+                await response_output.send(full_response)
+                self._queue_code_blocks(code_blocks, code_block_parser.feed(full_response))
+            else:
+                full_response = ""
+                # close the generator right away on errors so its model server or host slot lease is released
+                async with aclosing(self.llm_client.send_prompt(prompt_text, model_name, self.history)) as chunks:
+                    async for chunk in chunks:
+                        if not chunk:
+                            continue
+                        full_response += chunk
+                        await response_output.write(chunk)
+                        self._queue_code_blocks(code_blocks, code_block_parser.feed(chunk))
+                await response_output.close()
+        except BaseException:
+            code_block_worker.cancel()
+            raise
+
+        code_blocks.put_nowait(None)
         if test_input:
-            full_response = config.TEST_INPUT
-            await self.consumer.send_json({"response": full_response})
-            await sleep(config.SLEEP_DURATION)
+            self.persist_message(ROLE_ASSISTANT, full_response, self._count_tokens(full_response, model_name))
         else:
-            response_generator = self.llm_client.send_prompt(prompt_text, model_name)
-            full_response = ""
-            async for chunk in response_generator:
-                if not chunk:
-                    continue
-                full_response += chunk
-                await self.consumer.send_json({"response": chunk})
-                await sleep(config.SLEEP_DURATION)
-        if full_response:
-            self.write_response_to_file(full_response)
-            await self.process_code_blocks(full_response)
+            self.history.add(ROLE_USER, prompt_text, model_name)
+            response_tokens = self.history.add(ROLE_ASSISTANT, full_response, model_name)
+            self.persist_message(ROLE_ASSISTANT, full_response, response_tokens)
+            self._schedule_summary(model_name)
+        await code_block_worker
 
-    @staticmethod
-    def write_response_to_file(response: str) -> None:
-        data_folder = Path(__file__).resolve().parent.parent / "data"
-        data_folder.mkdir(exist_ok=True)
-        file_path = data_folder / "test_input.log"
-        with file_path.open("w") as file:
-            file.write(response)
-
-    async def process_code_blocks(self, full_response: str) -> None:
-        code_blocks_with_language = CodeValidator.extract_code_blocks(full_response)
-        if not code_blocks_with_language:
+    def _schedule_summary(self, model_name: str) -> None:
+        if not config.HISTORY_SUMMARY_ENABLED:
             return
-        for language, code_block in code_blocks_with_language:
+        if self._summary_task is None or self._summary_task.done():
+            summarize = partial(self.llm_client.summarize, model_name=model_name)
+            self._summary_task = asyncio.create_task(self.history.refresh_summary(summarize))
+
+    @staticmethod
+    def _count_tokens(text: str, model_name: str) -> int | None:
+        return token_counter.count(text, model_name) if model_name in config.LLM_APIS else None
+
+    @staticmethod
+    def _queue_code_blocks(
+        code_blocks: asyncio.Queue[tuple[str | None, str] | None], parsed_blocks: list[tuple[str | None, str]]
+    ) -> None:
+        for code_block in parsed_blocks:
+            code_blocks.put_nowait(code_block)
+
+    def persist_message(self, role: str, text: str, token_count: int | None = None) -> None:
+        if self.message_sink is not None:
+            self.message_sink(role, text, token_count)
+
+    async def process_code_blocks(self, code_blocks: asyncio.Queue[tuple[str | None, str] | None]) -> None:
+        while (item := await code_blocks.get()) is not None:
+            language, code_block = item
             await self.process_code_block(code_block, language)
 
     async def process_code_block(self, code_block: str, language) -> None:
         if language in ["bash", "sh", "shell"]:
-            bash_output = self.docker_manager.execute_bash_generator(code_block)
-
-            await self.consumer.send_json({"code": f"Executing:\n{code_block}\nResult:"})
-            for line in bash_output:
-                await self.consumer.send_json({"code": line})
-                await sleep(config.SLEEP_DURATION)
-            await self.consumer.send_json({"code": "=" * 50})
-            await sleep(config.SLEEP_DURATION)
-
-        if language in ["py", "python"] and CodeValidator.is_valid_python(code_block):
-            formatted_code = CodeValidator.format_with_black(code_block)
-            code_imports = CodeValidator.extract_python_imports(formatted_code)
-            pip_output = self.docker_manager.execute_pip_install(code_imports)
-
-            await self.consumer.send_json({"code": pip_output})
-            await sleep(config.SLEEP_DURATION)
-            (
-                error_count,
-                warning_count,
-                messages,
-            ) = CodeValidator.run_pylint_static_analysis(formatted_code)
-            if error_count > 0:
-                logger.error(f"Code block has {error_count} errors, {warning_count} warnings: {messages}")
-
-            await self.execute_and_send_code(formatted_code)
+            bash_output = self.docker_manager.execute_bash_generator_async(code_block)
+
+            await self.code_output.send(f"Executing:\n{code_block}\nResult:")
+            bash_lines = []
+            async for line in bash_output:
+                bash_lines.append(line)
+                await self.code_output.write(line)
+            await self.code_output.send("=" * 50)
+            self.persist_message(ROLE_EXECUTION, "".join(bash_lines))
+
+        if language in ["py", "python"]:
+            validation = await validation_service.validate(code_block)
+            if not validation.is_valid:
+                return
+            local_modules = await self.docker_manager.find_local_modules_async(validation.imports)
+            packages = package_index.resolve(validation.imports, local_modules)
+            pip_output = await self.docker_manager.execute_pip_install_async(packages)
+
+            await self.code_output.send(pip_output)
+            if validation.error_count > 0:
+                logger.error(
+                    f"Code block has {validation.error_count} errors, {validation.warning_count} warnings: "
+                    f"{validation.messages}"
+                )
+
+            await self.execute_and_send_code(validation.formatted_code)
 
     async def execute_and_send_code(self, code: str) -> None:
-        docker_output = self.docker_manager.execute_python_string(code)
-        await self.consumer.send_json({"code": docker_output})
-        await sleep(config.SLEEP_DURATION)
+        docker_output = await self.docker_manager.execute_python_string_async(code)
+        await self.code_output.send(docker_output)
+        _exit_code, output = docker_output
+        self.persist_message(ROLE_EXECUTION, output)
@@ -1,83 +1,129 @@
 # code_validation.py
+import io
 import re
 import sys
-import tempfile
 import ast
-from typing import Tuple
+from dataclasses import dataclass, field
+from functools import cache
+from typing import TYPE_CHECKING, Tuple
 
+from components.config import config
 
-from pylint.lint import PyLinter
-from black import format_str, FileMode
-from pathlib import Path
+if TYPE_CHECKING:
+    from pylint.lint import PyLinter
 
-from stdlib_list import stdlib_list
 
-from components.config import config
+@dataclass
+class CodeAnalysis:
+    code: str
+    tree: ast.Module | None
+    imports: set[str] = field(default_factory=set)
+
+    @property
+    def is_valid(self) -> bool:
+        return self.tree is not None
+
+
+class CodeBlockParser:
+    FENCE = "```"
+
+    def __init__(self) -> None:
+        recognized_languages = config.RECOGNIZED_LANGUAGES
+        self._block_pattern = re.compile(rf"({'|'.join(recognized_languages)})?\n?([\s\S]*)")
+        self._buffer = ""
+        self._scan_from = 0
+        self._in_block = False
+
+    def feed(self, chunk: str) -> list[Tuple[str | None, str]]:
+        self._buffer += chunk
+        code_blocks = []
+        while True:
+            fence_index = self._buffer.find(self.FENCE, self._scan_from)
+            if fence_index < 0:
+                # a fence may be split across chunks, so rescan the last few characters next time
+                if self._in_block:
+                    self._scan_from = max(0, len(self._buffer) - len(self.FENCE) + 1)
+                else:
+                    self._buffer = self._buffer[-(len(self.FENCE) - 1) :]
+                    self._scan_from = 0
+                return code_blocks
+
+            if self._in_block:
+                code_blocks.append(self._parse_block(self._buffer[:fence_index]))
+            self._in_block = not self._in_block
+            self._buffer = self._buffer[fence_index + len(self.FENCE) :]
+            self._scan_from = 0
+
+    def _parse_block(self, block_text: str) -> Tuple[str | None, str]:
+        match = self._block_pattern.match(block_text)
+        if not match:
+            return None, block_text.strip()
+        language, code = match.groups()
+        return language if language else None, code.strip()
 
 
 class CodeValidator:
     @staticmethod
-    def extract_code_blocks(text: str) -> list[Tuple[str | None, str]] | None:
-        recognized_languages = config.RECOGNIZED_LANGUAGES
-        pattern = rf"```({'|'.join(recognized_languages)})?\n?([\s\S]*?)```"
-        code_blocks = re.findall(pattern, text)
-        if not code_blocks:
-            return None
-        return [
-            (block[0] if block[0] else None, "\n".join(block[1].strip().split("\n")))
-            for block in code_blocks
-        ]
+    @cache
+    def standard_library_modules() -> frozenset[str]:
+        if hasattr(sys, "stdlib_module_names"):
+            return frozenset(sys.stdlib_module_names)
+        from stdlib_list import stdlib_list
+
+        return frozenset(stdlib_list(version=f"{sys.version_info.major}.{sys.version_info.minor}"))
 
     @staticmethod
-    def extract_python_imports(code: str) -> set[str]:
+    def analyze(code: str) -> CodeAnalysis:
         try:
-            standard_libs = set(
-                stdlib_list(
-                    version=f"{sys.version_info.major}.{sys.version_info.minor}"
-                )
-            )
             tree = ast.parse(code)
-            imports = set()
-            for node in ast.walk(tree):
-                if isinstance(node, ast.Import):
-                    imports.update([name.name for name in node.names])
-                elif isinstance(node, ast.ImportFrom):
-                    if node.module:  # Check if the module is not None
-                        imports.add(node.module)
-            non_standard_libs = imports - standard_libs
-            return non_standard_libs
         except SyntaxError:
-            # Handle invalid Python code
-            return set()
+            return CodeAnalysis(code, None)
 
-    @staticmethod
-    def is_valid_python(code: str) -> bool:
-        try:
-            ast.parse(code)
-            return True
-        except SyntaxError:
-            return False
+        imports = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imports.update([name.name.split(".")[0] for name in node.names])
+            elif isinstance(node, ast.ImportFrom):
+                # relative imports always refer to local modules
+                if node.module and node.level == 0:
+                    imports.add(node.module.split(".")[0])
+
+        non_standard_libs = imports - CodeValidator.standard_library_modules()
+        return CodeAnalysis(code, tree, non_standard_libs)
 
     @staticmethod
     def format_with_black(code: str) -> str:
+        from black import FileMode, format_str
+
         return format_str(code, mode=FileMode())
 
     @staticmethod
-    def run_pylint_static_analysis(code: str) -> tuple[int, int, list[str]]:
-        with tempfile.NamedTemporaryFile(
-            delete=False, suffix=".py", mode="w"
-        ) as temp_file:
-            temp_file.write(code)
-            temp_file_path = Path(temp_file.name)
+    def create_linter(disabled_checks: list[str] | None = None) -> "PyLinter":
+        from pylint.lint import PyLinter
+        from pylint.reporters import CollectingReporter
 
-        linter = PyLinter()
-        linter.set_option("disable", config.PYLINT_DISABLED_CHECKS)
+        linter = PyLinter(reporter=CollectingReporter())
+        linter.load_default_plugins()
+        linter.set_option("persistent", False)
+        linter.set_option("from-stdin", True)
+        linter.set_option("disable", disabled_checks or config.PYLINT_DISABLED_CHECKS)
+        return linter
 
-        linter.check([str(temp_file_path)])
+    @staticmethod
+    def lint_with(linter: "PyLinter", code: str) -> tuple[int, int, list[str]]:
+        from pylint.utils import LinterStats
 
-        error_count = linter.stats.by_msg.get("E", 0)
-        warning_count = linter.stats.by_msg.get("W", 0)
-        messages = [str(msg) for msg in linter.reporter.messages]
+        # With from-stdin set pylint reads the module source from sys.stdin, so nothing touches the disk.
+        original_stdin = sys.stdin
+        sys.stdin = io.TextIOWrapper(io.BytesIO(code.encode()), encoding="utf-8")
+        linter.stats = LinterStats()
+        linter.reporter.messages = []
+        try:
+            linter.check(["snippet.py"])
+        finally:
+            sys.stdin = original_stdin
 
-        temp_file_path.unlink()
+        error_count = linter.stats.error
+        warning_count = linter.stats.warning
+        messages = [str(msg) for msg in linter.reporter.messages]
         return error_count, warning_count, messages
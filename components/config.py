@@ -1,10 +1,13 @@
 import logging
 import os
+import threading
 import tomllib
 from dataclasses import dataclass
+from functools import cache
 from pathlib import Path
+from time import sleep
+from types import MappingProxyType
 
-from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
 
@@ -15,8 +18,19 @@ class LLMApi:
     key: str
     max_context_tokens: int
     max_output_tokens: int = 0
+    tokenizer: str = "gpt2"
+    http2: bool = False
+    local: bool = False
+    kv_cache_bytes_per_token: int = 0
 
 
+@dataclass(frozen=True)
+class SystemPrompts:
+    system_messages: MappingProxyType[str, str]
+    test_input: str
+
+
+@cache
 def get_project_name() -> str:
     config_file = Path(__file__).parent.parent / "pyproject.toml"
     toml_content = load_toml_file(config_file)
@@ -45,87 +59,256 @@ def load_toml_file(file_path: Path) -> dict:
 
 class Config:
     home_dir = Path.home()
-    dotenv_path = home_dir / ".config" / get_project_name() / ".env"
-    load_dotenv(dotenv_path)
+
+    MODULE_DISTRIBUTIONS_FILE = Path(__file__).parent.parent / "data" / "module_distributions.toml"
+    CONFIG_WATCH_INTERVAL = 2.0
 
     def __init__(self) -> None:
+        # Nothing is read from disk until a setting that needs it is first used, so importing this
+        # module stays cheap for management commands and worker boot.
         self._toml_config: dict[str, dict[str, str]] = {}
         self.SYSTEM_MESSAGES_FILE = Path(__file__).parent.parent / "data" / "system_messages.toml"
-        self.SYSTEM_MESSAGES: dict[str, str] = {}
-        self.TEST_INPUT = ""
-        self._load_system_messages()
+        self.LLM_APIS_FILE = Path(__file__).parent.parent / "data" / "llm_apis.toml"
+        # replaced as a whole on reload, so a reader never sees messages and test input from different files
+        self._system_prompts = SystemPrompts(MappingProxyType({}), "")
+        self._llm_apis: dict[str, LLMApi] = {}
+        self.version = 0
+        self._loaded = False
+        self._dotenv_loaded = False
+        self._file_signatures: dict[Path, tuple[int, int, int] | None] = {}
+        self._reload_lock = threading.Lock()
+        self._watcher_thread: threading.Thread | None = None
+
+    @property
+    def user_config_dir(self) -> Path:
+        return self.home_dir / ".config" / get_project_name()
+
+    @property
+    def dotenv_path(self) -> Path:
+        return self.user_config_dir / ".env"
+
+    @property
+    def LOCAL_MODULE_DISTRIBUTIONS_FILE(self) -> Path:
+        return self.user_config_dir / "module_distributions.toml"
+
+    @property
+    def SYSTEM_PROMPTS(self) -> SystemPrompts:
+        self._ensure_loaded()
+        return self._system_prompts
+
+    @property
+    def SYSTEM_MESSAGES(self) -> MappingProxyType[str, str]:
+        return self.SYSTEM_PROMPTS.system_messages
+
+    @property
+    def TEST_INPUT(self) -> str:
+        return self.SYSTEM_PROMPTS.test_input
+
+    @property
+    def LLM_APIS(self) -> dict[str, LLMApi]:
+        self._ensure_loaded()
+        return self._llm_apis
+
+    def load_environment(self) -> None:
+        if not self._dotenv_loaded:
+            from dotenv import load_dotenv
+
+            load_dotenv(self.dotenv_path)
+            self._dotenv_loaded = True
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.reload(force=True)
 
     def _load_system_messages(self) -> None:
         self._toml_config = load_toml_file(self.SYSTEM_MESSAGES_FILE)
         languages = ["python"]
         if not languages:
             logger.warning("No languages found in system_messages.toml.")
+        system_messages = {}
         for language in languages:
             system_message = self._toml_config["SYSTEM_MESSAGE"].get(language, "")
-            self.SYSTEM_MESSAGES[language] = system_message
-        self.TEST_INPUT = self._toml_config["TEST_MESSAGES"].get("input", "")
+            system_messages[language] = system_message
+        test_input = self._toml_config["TEST_MESSAGES"].get("input", "")
+        self._system_prompts = SystemPrompts(MappingProxyType(system_messages), test_input)
+
+    def _load_llm_apis(self) -> None:
+        self.load_environment()
+        llm_apis = {}
+        for model_name, llm_api_config in load_toml_file(self.LLM_APIS_FILE).get("LLM_APIS", {}).items():
+            llm_api_config = dict(llm_api_config)
+            key_env = llm_api_config.pop("key_env", None)
+            if key_env:
+                llm_api_config["key"] = os.environ.get(key_env, "")
+                if not llm_api_config["key"]:
+                    logger.warning(f"Environment variable {key_env} for model {model_name} is not set.")
+            llm_apis[model_name] = LLMApi(**llm_api_config)
+        self._llm_apis = llm_apis
 
-    def reload(self) -> None:
-        self._load_system_messages()
+    def reload(self, force: bool = False) -> bool:
+        with self._reload_lock:
+            changed = False
+            try:
+                for file_path, loader in (
+                    (self.SYSTEM_MESSAGES_FILE, self._load_system_messages),
+                    (self.LLM_APIS_FILE, self._load_llm_apis),
+                ):
+                    signature = self._file_signature(file_path)
+                    if not force and signature == self._file_signatures.get(file_path):
+                        continue
+                    logger.info(f"Loading {file_path.name}.")
+                    loader()
+                    self._file_signatures[file_path] = signature
+                    changed = True
+            finally:
+                # a later loader failing must not hide a file that was already swapped in, since its stored
+                # signature means the watcher will not load it again
+                if changed:
+                    self.version += 1
+            self._loaded = True
+            return changed
 
+    def start_watcher(self, interval: float | None = None) -> None:
+        if self._watcher_thread and self._watcher_thread.is_alive():
+            return
+        self._watcher_thread = threading.Thread(
+            target=self._watch, args=(interval or self.CONFIG_WATCH_INTERVAL,), name="config-watcher", daemon=True
+        )
+        self._watcher_thread.start()
+
+    def _watch(self, interval: float) -> None:
+        while True:
+            sleep(interval)
+            try:
+                self.reload()
+            except (FileNotFoundError, PermissionError, RuntimeError, KeyError, TypeError) as e:
+                logger.warning(f"Keeping previous configuration, reload failed: {e}")
+
+    @staticmethod
+    def _file_signature(file_path: Path) -> tuple[int, int, int] | None:
+        try:
+            file_stat = file_path.stat()
+        except FileNotFoundError:
+            return None
+        return file_stat.st_mtime_ns, file_stat.st_ino, file_stat.st_size
+
+    HISTORY_RESERVED_OUTPUT_TOKENS = 1024
+    HISTORY_SUMMARY_ENABLED = False
+    HISTORY_SUMMARY_MIN_TURNS = 4
+    HISTORY_SUMMARY_MAX_TOKENS = 512
+    HISTORY_SUMMARY_PROMPT = (
+        "Summarize the following conversation between a user and a coding assistant. Keep the user's goals, "
+        "decisions that were made and the code that is still relevant. Reply with the summary only."
+    )
     MINIMUM_COMPLETION_TOKENS = 100
+    TOKEN_COUNT_CACHE_SIZE = 4096
 
     _DOCKER_HOST = "docker.local"
     _DOCKER_PORT = 2375
 
     DOCKER_URL = f"tcp://{_DOCKER_HOST}:{_DOCKER_PORT}"
     DOCKET_DETACH_TIMEOUT = 10
+    DOCKER_MAX_POOL_SIZE = 32
+    EXECUTOR_MAX_WORKERS = 64
+    LONG_RUNNING_EXECUTOR_MAX_WORKERS = 64
+    EXEC_OUTPUT_QUEUE_SIZE = 256
+    EXEC_WATCHDOG_POLL_INTERVAL = 1.0
+    EXEC_WATCHDOG_BATCH_SIZE = 50
+
+    PYTHON_KERNEL_ENABLED = False
+    PYTHON_KERNEL_START_TIMEOUT = 10
+    PYTHON_KERNEL_TIMEOUT = DOCKET_DETACH_TIMEOUT
+    PYTHON_KERNEL_INTERRUPT_GRACE = 2
+
+    SANDBOX_IMAGE = "python:3.11"
+    CONTAINER_POOL_MIN_SIZE = 2
+    CONTAINER_POOL_MAX_SIZE = 20
+    CONTAINER_POOL_IDLE_TTL = 300
+    CONTAINER_POOL_HEALTH_CHECK_INTERVAL = 15
+    CONTAINER_POOL_LEASE_TIMEOUT = 60
+    CONTAINER_POOL_MAX_USES = 10
+
+    PIP_INSTALL_TIMEOUT = 300
+    PIP_CACHE_VOLUME = "shinygpt-pip-cache"
+    # kept outside /root, which is restored from a snapshot whenever a pooled container is reset
+    PIP_CACHE_PATH = "/var/cache/shinygpt-pip"
+    PIP_NEGATIVE_CACHE_TTL = 24 * 60 * 60
+    # only these mean the package does not exist; timeouts and network errors are worth retrying
+    PIP_UNAVAILABLE_MARKERS = ("No matching distribution found", "Could not find a version that satisfies")
+
+    IMAGE_CACHE_REPOSITORY = "shinygpt-sandbox"
+    IMAGE_CACHE_MAX_IMAGES = 20
+    IMAGE_CACHE_MAX_BYTES = 20 * 1024**3
 
-    _POSTGRES_HOST = "localhost"
-    _POSTGRES_DATABASE = "fastgpt"
+    # "sqlite" for a single box, "postgres" for production
+    DATABASE_BACKEND = "sqlite"
+    DATABASE_CONN_MAX_AGE = 600
+    DATABASE_POOL_MIN_SIZE = 2
+    DATABASE_POOL_MAX_SIZE = 20
 
-    PSQL_URL = f"postgresql+asyncpg://{_POSTGRES_HOST}/{_POSTGRES_DATABASE}"
+    POSTGRES_HOST = "localhost"
+    POSTGRES_PORT = 5432
+    POSTGRES_DATABASE = "fastgpt"
+    POSTGRES_USER = "shinygpt"
+    POSTGRES_PASSWORD_ENV = "POSTGRES_PASSWORD"
+
+    SQLITE_TIMEOUT = 20
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -64000,
+        "temp_store": "MEMORY",
+        "mmap_size": 256 * 1024**2,
+    }
 
     REDIS_HOST = "docker.local"
     REDIS_PORT = 6379
 
-    SLEEP_DURATION = 0.00001
+    OUTPUT_FLUSH_INTERVAL = 0.05
+    OUTPUT_FLUSH_BYTES = 4096
+
+    MESSAGE_WRITE_BATCH_SIZE = 100
+    MESSAGE_WRITE_FLUSH_INTERVAL = 0.5
+    MESSAGE_WRITE_QUEUE_SIZE = 10000
+    # "spill" appends messages that do not fit in the queue to MESSAGE_SPILL_FILE for replay, "drop" discards them
+    MESSAGE_WRITE_OVERFLOW_POLICY = "spill"
+    MESSAGE_SPILL_FILE = Path(__file__).parent.parent / "data" / "message_spill.jsonl"
+
+    HISTORY_PAGE_SIZE = 50
+    HISTORY_PAGE_MAX_SIZE = 500
+    HISTORY_STREAM_CHUNK_SIZE = 100
     LLM_LOADING_TIMEOUT = 60
+    LLM_HEALTH_CHECK_INTERVAL = 10.0
+    LLM_HEALTH_CHECK_TIMEOUT = 2.0
+    LLM_HEALTH_POLL_INTERVAL = 0.5
+    LLM_SERVER_RESTART_DELAY = 2.0
+    LLM_SERVER_BINARY = Path(__file__).parent.parent / "external" / "llama.cpp" / "server"
+    LLM_FILES_DIR = Path(__file__).parent.parent / "data" / "llm_files"
+    LOCAL_MODEL_PORTS = range(8080, 8180)
+    LOCAL_MODEL_RAM_BUDGET = 48 * 1024**3
+    LOCAL_MODEL_STOP_TIMEOUT = 10
+    LOCAL_MODEL_PARALLEL_SLOTS = 2
+    # f16 K and V for a ~34B model with grouped-query attention; set kv_cache_bytes_per_token per model to refine
+    LOCAL_MODEL_KV_CACHE_BYTES_PER_TOKEN = 256 * 1024
+    LOCAL_MODEL_CACHE_PROMPT = True
+    HOSTNAMES_FILE = Path(__file__).parent.parent / "data" / "hostnames"
+    INFERENCE_HOST_DEFAULT_PORT = 8080
+    INFERENCE_HOST_REFRESH_INTERVAL = 30.0
+    LLM_MAX_CONNECTIONS = 100
+    LLM_MAX_KEEPALIVE_CONNECTIONS = 20
+    LLM_KEEPALIVE_EXPIRY = 30.0
+    LLM_CONNECT_TIMEOUT = 5.0
+    LLM_REQUEST_TIMEOUT = 600.0
 
     RECOGNIZED_LANGUAGES = ["python", "js", "javascript", "bash"]
 
     PYLINT_DISABLED_CHECKS = ["C0114", "C0116"]
-
-    # noinspection SpellCheckingInspection
-    LLM_APIS: dict[str, LLMApi] = {
-        "deepseek-coder-33b": LLMApi(
-            url="http://localhost:8080/v1",
-            key="sk-2f2b2b2b2b2b2b2b2b2b2b2b2b2b2b2b",
-            max_context_tokens=4 * 1024,
-        ),
-        "phind-codellama-34": LLMApi(
-            url="http://localhost:8080/v1",
-            key="sk-2f2b2b2b2b2b2b2b2b2b2b2b2b2b2b",
-            max_context_tokens=4 * 1024,
-        ),
-        "gpt-4": LLMApi(
-            url="https://api.openai.com/v1",
-            key=os.environ["OPENAI_API_KEY"],
-            max_context_tokens=8 * 1024,
-        ),
-        "gpt-4-1106-preview": LLMApi(
-            url="https://api.openai.com/v1",
-            key=os.environ["OPENAI_API_KEY"],
-            max_context_tokens=120_000,
-            max_output_tokens=4 * 1024,
-        ),
-        "gpt-3.5-turbo-16k": LLMApi(
-            url="https://api.openai.com/v1",
-            key=os.environ["OPENAI_API_KEY"],
-            max_context_tokens=16 * 1024,
-        ),
-        "gpt-3.5-turbo-1106": LLMApi(
-            url="https://api.openai.com/v1",
-            key=os.environ["OPENAI_API_KEY"],
-            max_context_tokens=16 * 1024,
-            max_output_tokens=4 * 1024,
-        ),
-    }
+    VALIDATION_WORKERS = 2
+    VALIDATION_MAX_CONCURRENCY = 8
+    VALIDATION_CACHE_SIZE = 1024
+    VALIDATION_CACHE_DIR: Path | None = None
+    VALIDATION_DISK_CACHE_MAX_ENTRIES = 100000
 
 
 config = Config()
@@ -0,0 +1,250 @@
+# container_pool.py
+import logging
+import threading
+from dataclasses import dataclass, field
+from time import monotonic
+
+from docker.errors import DockerException
+from docker.models.containers import Container
+
+from components.config import config
+from components.resource_hub import resource_hub
+
+logger = logging.getLogger(__name__)
+
+_SITE_PACKAGES = "$(python -c 'import sysconfig; print(sysconfig.get_paths()[\"purelib\"])')"
+_BASELINE_ARCHIVE = "/var/lib/shinygpt/baseline.tar"
+# Snapshot of everything a session can change through pip or its home directory, taken before any user code runs.
+_SNAPSHOT_COMMAND = (
+    f"site_packages={_SITE_PACKAGES} && mkdir -p /var/lib/shinygpt /app && "
+    f'tar -C / -cf {_BASELINE_ARCHIVE} root usr/local/bin "${{site_packages#/}}"'
+)
+# Kill everything but PID 1 and this shell, then restore the snapshot, so the next lessee starts from the base image.
+_RESET_COMMAND = (
+    f"site_packages={_SITE_PACKAGES} && "
+    'for proc in /proc/[0-9]*; do pid=${proc#/proc/}; '
+    '[ "$pid" -ne 1 ] && [ "$pid" -ne $$ ] && kill -KILL "$pid" 2>/dev/null; done; '
+    'rm -rf /app /tmp/* /tmp/.[!.]* /root /usr/local/bin "$site_packages" && '
+    f"tar -C / -xf {_BASELINE_ARCHIVE} && mkdir -p /app"
+)
+
+
+@dataclass
+class PooledContainer:
+    container: Container
+    image: str = config.SANDBOX_IMAGE
+    created_at: float = field(default_factory=monotonic)
+    idle_since: float = field(default_factory=monotonic)
+    uses: int = 0
+
+
+class ContainerPool:
+    def __init__(self, image: str = config.SANDBOX_IMAGE) -> None:
+        self.image = image
+        self.min_size = config.CONTAINER_POOL_MIN_SIZE
+        self.max_size = config.CONTAINER_POOL_MAX_SIZE
+        self.idle_ttl = config.CONTAINER_POOL_IDLE_TTL
+        self._idle: list[PooledContainer] = []
+        self._leased: dict[str, PooledContainer] = {}
+        self._starting = 0
+        self._checking = 0
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._maintenance_thread: threading.Thread | None = None
+
+    @property
+    def size(self) -> int:
+        return len(self._idle) + len(self._leased) + self._starting + self._checking
+
+    def start(self) -> None:
+        with self._condition:
+            if self._maintenance_thread and self._maintenance_thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._maintenance_thread = threading.Thread(
+                target=self._maintenance_loop, name="container-pool", daemon=True
+            )
+            self._maintenance_thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._condition.notify_all()
+        for pooled in idle:
+            self._destroy(pooled.container)
+
+    def lease(self, image: str | None = None, timeout: float = config.CONTAINER_POOL_LEASE_TIMEOUT) -> Container:
+        self.start()
+        image = image or self.image
+        deadline = monotonic() + timeout
+        while True:
+            pooled = self._take_idle_or_reserve(image, deadline, timeout)
+            if pooled is None:
+                break
+            # the health check is a Docker API round trip, so make it without holding the pool lock
+            healthy = self._is_healthy(pooled.container)
+            with self._condition:
+                self._checking -= 1
+                if healthy:
+                    pooled.uses += 1
+                    self._leased[pooled.container.id] = pooled
+                self._condition.notify_all()
+            if healthy:
+                return pooled.container
+            logger.warning(f"Discarding unhealthy pooled container {pooled.container.short_id}.")
+            self._destroy_async(pooled.container)
+
+        container = self._start_pending_container(image)
+        with self._condition:
+            self._starting -= 1
+            self._leased[container.id] = PooledContainer(container, image=image, uses=1)
+            self._condition.notify_all()
+        return container
+
+    def _take_idle_or_reserve(self, image: str, deadline: float, timeout: float) -> PooledContainer | None:
+        # Returns an idle container to health check, or None once a slot for a new container has been reserved.
+        with self._condition:
+            while True:
+                if self._idle and image == self.image:
+                    self._checking += 1
+                    return self._idle.pop()
+                if self.size < self.max_size:
+                    self._starting += 1
+                    return None
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No sandbox container available after {timeout} seconds")
+                self._condition.wait(remaining)
+
+    def release(self, container: Container) -> None:
+        with self._condition:
+            pooled = self._leased.pop(container.id, None)
+            self._condition.notify_all()
+        if pooled is None:
+            self._destroy(container)
+            return
+
+        if (
+            self._stop_event.is_set()
+            or pooled.image != self.image
+            or pooled.uses >= config.CONTAINER_POOL_MAX_USES
+            or not self._reset(container)
+        ):
+            self._destroy(container)
+            with self._condition:
+                self._condition.notify_all()
+            return
+
+        with self._condition:
+            pooled.idle_since = monotonic()
+            self._idle.append(pooled)
+            self._condition.notify_all()
+
+    def _start_pending_container(self, image: str) -> Container:
+        try:
+            return self._run_container(image)
+        except Exception:
+            with self._condition:
+                self._starting -= 1
+                self._condition.notify_all()
+            raise
+
+    def _run_container(self, image: str) -> Container:
+        logger.info(f"Starting sandbox container from {image}.")
+        container = resource_hub.docker_client.containers.run(
+            image=image,
+            detach=True,
+            tty=True,
+            stdin_open=True,
+            # read-only, so code in one session cannot plant cache entries that another session then installs;
+            # only ImageCache.build, which runs nothing but pip, writes to it
+            volumes={config.PIP_CACHE_VOLUME: {"bind": config.PIP_CACHE_PATH, "mode": "ro"}},
+            environment={"PIP_CACHE_DIR": config.PIP_CACHE_PATH},
+        )
+        exit_code, output = container.exec_run(cmd=["/bin/bash", "-c", _SNAPSHOT_COMMAND])
+        if exit_code != 0:
+            self._destroy(container)
+            raise DockerException(f"Failed to snapshot sandbox container: {output!r}")
+        return container
+
+    @staticmethod
+    def _reset(container: Container) -> bool:
+        try:
+            exit_code, _output = container.exec_run(cmd=["/bin/bash", "-c", _RESET_COMMAND])
+        except DockerException as e:
+            logger.warning(f"Failed to reset container {container.short_id}: {e}")
+            return False
+        return exit_code == 0
+
+    @staticmethod
+    def _is_healthy(container: Container) -> bool:
+        try:
+            container.reload()
+        except DockerException:
+            return False
+        return container.status == "running"
+
+    @staticmethod
+    def _destroy(container: Container) -> None:
+        try:
+            container.remove(force=True)
+        except DockerException as e:
+            logger.warning(f"Failed to remove container {container.short_id}: {e}")
+
+    def _destroy_async(self, container: Container) -> None:
+        threading.Thread(target=self._destroy, args=(container,), daemon=True).start()
+
+    def _maintenance_loop(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self._reap_and_check()
+                self._replenish()
+            except DockerException as e:
+                logger.warning(f"Container pool maintenance failed: {e}")
+            self._stop_event.wait(config.CONTAINER_POOL_HEALTH_CHECK_INTERVAL)
+
+    def _reap_and_check(self) -> None:
+        now = monotonic()
+        with self._condition:
+            candidates = list(self._idle)
+            surplus = len(candidates) - self.min_size
+
+        expired: list[PooledContainer] = []
+        unhealthy: list[PooledContainer] = []
+        for pooled in sorted(candidates, key=lambda item: item.idle_since):
+            if surplus > 0 and now - pooled.idle_since > self.idle_ttl:
+                expired.append(pooled)
+                surplus -= 1
+            elif not self._is_healthy(pooled.container):
+                unhealthy.append(pooled)
+
+        # a lease() may have taken any of them while the lock was released, so only destroy what is still idle
+        with self._condition:
+            expired = [pooled for pooled in expired if pooled in self._idle]
+            unhealthy = [pooled for pooled in unhealthy if pooled in self._idle]
+            for pooled in expired + unhealthy:
+                self._idle.remove(pooled)
+            self._condition.notify_all()
+
+        for pooled in expired:
+            logger.info(f"Reaping idle sandbox container {pooled.container.short_id}.")
+            self._destroy(pooled.container)
+        for pooled in unhealthy:
+            logger.warning(f"Removing unhealthy sandbox container {pooled.container.short_id}.")
+            self._destroy(pooled.container)
+
+    def _replenish(self) -> None:
+        while not self._stop_event.is_set():
+            with self._condition:
+                if len(self._idle) + self._starting >= self.min_size or self.size >= self.max_size:
+                    return
+                self._starting += 1
+            container = self._start_pending_container(self.image)
+            with self._condition:
+                self._starting -= 1
+                self._idle.append(PooledContainer(container, image=self.image))
+                self._condition.notify_all()
+
+
+container_pool = ContainerPool()
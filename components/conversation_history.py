@@ -0,0 +1,107 @@
+# conversation_history.py
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from components.config import config
+from components.tokenization import token_counter
+
+logger = logging.getLogger(__name__)
+
+# the values api_django.models.Message stores in its role column
+ROLE_USER = "user"
+ROLE_ASSISTANT = "assistant"
+ROLE_EXECUTION = "execution"
+
+
+@dataclass
+class Turn:
+    role: str
+    text: str
+    token_counts: dict[str, int] = field(default_factory=dict)
+
+    def tokens(self, model_name: str) -> int:
+        tokenizer_name = config.LLM_APIS[model_name].tokenizer
+        count = self.token_counts.get(tokenizer_name)
+        if count is None:
+            count = self.token_counts[tokenizer_name] = token_counter.count(self.text, model_name)
+        return count
+
+
+class ConversationHistory:
+    def __init__(self) -> None:
+        self.turns: list[Turn] = []
+        self.summary = ""
+        self._summarized_upto = 0
+        # The context window is always a suffix of self.turns. Its start only moves forward while the tokenizer
+        # and budget stay the same, so each turn costs one token count when it is added and one subtraction when
+        # it falls out, instead of re-walking the whole history every turn.
+        self._window_key: tuple[str, int] | None = None
+        self._window_start = 0
+        self._window_end = 0
+        self._window_tokens = 0
+
+    def add(self, role: str, text: str, model_name: str) -> int:
+        turn = Turn(role, text)
+        self.turns.append(turn)
+        return turn.tokens(model_name)
+
+    def context(self, model_name: str, budget: int, prompt_tokens: int = 0) -> list[Turn]:
+        # The cached window is keyed on the history budget alone, which stays the same from turn to turn, and is
+        # trimmed for the size of the current prompt on the way out.
+        budget -= self.summary_tokens(model_name)
+        key = (config.LLM_APIS[model_name].tokenizer, budget)
+        if key != self._window_key:
+            self._rebuild_window(model_name, budget)
+            self._window_key = key
+        else:
+            for turn in self.turns[self._window_end :]:
+                self._window_tokens += turn.tokens(model_name)
+            self._window_end = len(self.turns)
+            while self._window_tokens > budget and self._window_start < self._window_end:
+                self._window_tokens -= self.turns[self._window_start].tokens(model_name)
+                self._window_start += 1
+
+        start, tokens = self._window_start, self._window_tokens
+        while tokens > budget - prompt_tokens and start < self._window_end:
+            tokens -= self.turns[start].tokens(model_name)
+            start += 1
+        return self.turns[start : self._window_end]
+
+    def summary_tokens(self, model_name: str) -> int:
+        return token_counter.count(self.summary_message, model_name) if self.summary else 0
+
+    @property
+    def summary_message(self) -> str:
+        return f"Summary of the earlier conversation:\n{self.summary}"
+
+    async def refresh_summary(self, summarize: Callable[[str], Awaitable[str]]) -> None:
+        # fold the turns that fell out of the window into the cached summary
+        summarized_upto = self._window_start
+        dropped = self.turns[self._summarized_upto : summarized_upto]
+        if len(dropped) < config.HISTORY_SUMMARY_MIN_TURNS:
+            return
+        transcript = "\n\n".join(f"{turn.role}: {turn.text}" for turn in dropped)
+        if self.summary:
+            transcript = f"{self.summary_message}\n\n{transcript}"
+        try:
+            summary = await summarize(transcript)
+        except Exception as e:
+            logger.warning(f"Failed to summarize conversation history: {e}")
+            return
+        if summary:
+            self.summary = summary
+            self._summarized_upto = summarized_upto
+            self._window_key = None
+
+    def _rebuild_window(self, model_name: str, budget: int) -> None:
+        self._window_end = len(self.turns)
+        self._window_start = self._window_end
+        self._window_tokens = 0
+        # turns before _summarized_upto are already part of the summary
+        while self._window_start > self._summarized_upto:
+            tokens = self.turns[self._window_start - 1].tokens(model_name)
+            if self._window_tokens + tokens > budget:
+                break
+            self._window_tokens += tokens
+            self._window_start -= 1
@@ -1,146 +1,539 @@
 # docker_interaction.py
+import asyncio
 import base64
+import json
 import logging
+import shlex
+import struct
+import tarfile
 import threading
+import uuid
 from datetime import datetime
-from time import sleep
-from typing import Generator
+from io import BytesIO
+from pathlib import Path, PurePosixPath
+from time import monotonic, sleep, time
+from typing import AsyncGenerator, Generator
 
-import docker
+from docker.errors import DockerException
 from docker.models.containers import Container
 
 from components.config import config
+from components.container_pool import container_pool
+from components.exec_watchdog import exec_watchdog
+from components.image_cache import image_cache
+from components.package_index import package_index
+from components.resource_hub import resource_hub
 
 logger = logging.getLogger(__name__)
 
+_FIND_LOCAL_MODULES_COMMAND = (
+    'for name in "$@"; do if [ -d "/app/$name" ] || [ -f "/app/$name.py" ]; then echo "$name"; fi; done'
+)
+
 
 class DockerManager:
-    def __init__(self, image: str = "python:3.11") -> None:
-        self.client = docker.DockerClient(base_url=config.DOCKER_URL)
-        self.image = image
+    def __init__(self) -> None:
         self.container: Container | None = None
+        self.kernel: PythonKernel | None = None
+        self.installed_packages: set[str] = set()
+        self.local_modules: set[str] = set()
+        self.has_user_state = False
+        self.lease_failed = False
+        self._removed = False
+        self._lease_lock = threading.Lock()
 
     def start_container(self) -> None:
-        logger.info("Starting docker container.")
-        self.container = self.client.containers.run(image=self.image, detach=True, tty=True, stdin_open=True)
-        self._create_app_directory()
+        logger.info("Leasing docker container.")
+        try:
+            container = container_pool.lease()
+        except Exception:
+            self.lease_failed = True
+            raise
+        with self._lease_lock:
+            if not self._removed:
+                self.container = container
+                return
+        # the session ended while the lease was pending, so nobody else will hand this container back
+        logger.info(f"Releasing container {container.short_id} leased after its session ended.")
+        container_pool.release(container)
 
     def remove_container(self) -> None:
-        self._wait_for_container()
-        if not self.container:
+        with self._lease_lock:
+            self._removed = True
+            container, self.container = self.container, None
+        if not container:
+            # a start_container that is still leasing releases its container itself
             return
 
-        self.container.stop()
-        self.container.remove(force=True)
-        self.container = None
+        if self.kernel:
+            self.kernel.close()
+            self.kernel = None
+        self.installed_packages = set()
+        self.local_modules = set()
+        self.has_user_state = False
+        container_pool.release(container)
 
-    def _create_app_directory(self) -> None:
+    def put_files(self, files: dict[str, str | bytes], directory: str = "/app") -> None:
+        self._wait_for_container()
         if not self.container:
             return
-        self.container.exec_run(cmd="mkdir -p /app")
 
-    def execute_bash_generator(self, command: str) -> Generator[str, None, None]:
-        exec_instance = self.execute_bash_return_exec_instance(command)
+        self.has_user_state = True
+        self._record_local_modules(files, directory)
+        logger.debug(f"Uploading {len(files)} files to {directory}")
+        self.container.put_archive(directory, self._build_archive(files))
 
-        return exec_instance.get_output()
+    def get_files(self, names: set[str] | None = None, directory: str = "/app") -> dict[str, bytes]:
+        self._wait_for_container()
+        if not self.container:
+            return {}
 
-    def execute_bash_string(self, command: str) -> tuple[int, str]:
-        exec_instance = self.execute_bash_return_exec_instance(command)
+        stream, _stat = self.container.get_archive(directory)
+        return self._read_archive(b"".join(stream), names)
 
-        return exec_instance.get_exit_code() or 0, exec_instance.get_output_string()
+    async def execute_bash_generator_async(self, command: str) -> AsyncGenerator[str, None]:
+        self.has_user_state = True
+        exec_instance = await self.execute_bash_return_exec_instance_async(command)
+        async for line in exec_instance.get_output_async():
+            yield line
 
-    def execute_bash_return_exec_instance(self, command: str) -> "ExecInstance":
-        self._wait_for_container()
+    async def execute_bash_string_async(
+        self, command: str, timeout: float = config.DOCKET_DETACH_TIMEOUT
+    ) -> tuple[int, str]:
+        exec_instance = await self.execute_bash_return_exec_instance_async(command, timeout)
+        output = await exec_instance.get_output_string_async()
 
-        logger.debug(f"Executing bash command: {command}")
-
-        encoded_command = base64.b64encode(command.encode()).decode()
-        command_str = f"echo {encoded_command} | base64 --decode | /bin/bash"
+        return await exec_instance.get_exit_code_async() or 0, output
 
-        exec_instance = ExecInstance(self.container, command_str)
-        exec_instance.start()
+    async def execute_bash_return_exec_instance_async(
+        self, command: str, timeout: float = config.DOCKET_DETACH_TIMEOUT
+    ) -> "ExecInstance":
+        await self._wait_for_container_async()
 
-        monitor_thread = threading.Thread(target=exec_instance.monitor, args=(config.DOCKET_DETACH_TIMEOUT,))
-        monitor_thread.start()
+        exec_instance = self._create_exec_instance(command)
+        await exec_instance.start_async()
+        exec_watchdog.watch(exec_instance, timeout)
         return exec_instance
 
-    def save_python_script(self, code: str) -> str:
-        filename = f"script_{datetime.now().strftime('%Y%m%d%H%M%S')}.py"
-        filepath = f"/app/{filename}"
+    async def put_files_async(self, files: dict[str, str | bytes], directory: str = "/app") -> None:
+        await self._wait_for_container_async()
+        await asyncio.get_running_loop().run_in_executor(resource_hub.executor, self.put_files, files, directory)
+
+    async def get_files_async(self, names: set[str] | None = None, directory: str = "/app") -> dict[str, bytes]:
+        await self._wait_for_container_async()
+        return await asyncio.get_running_loop().run_in_executor(resource_hub.executor, self.get_files, names, directory)
 
-        command = f"cat <<EOF > {filepath}\n{code}\nEOF"
-        self.execute_bash_string(command)
+    async def save_python_script_async(self, code: str) -> str:
+        filepath = self._new_script_path()
+        await self.put_files_async({filepath: code}, directory="/")
 
         return filepath
 
-    def execute_python_string(self, code: str) -> tuple[int, str]:
-        python_script_path = self.save_python_script(code)
-        error_code, output = self.execute_python_script(python_script_path)
+    async def execute_python_string_async(self, code: str) -> tuple[int, str]:
+        if config.PYTHON_KERNEL_ENABLED:
+            await self._wait_for_container_async()
+            kernel = self._get_kernel()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(resource_hub.long_running_executor, kernel.execute, code)
+        python_script_path = await self.save_python_script_async(code)
+        error_code, output = await self.execute_python_script_async(python_script_path)
         return error_code, output
 
-    def execute_python_script(self, file_path: str) -> tuple[int, str]:
-        error_code, output = self.execute_bash_string(f"python {file_path}")
+    async def execute_python_files_async(self, files: dict[str, str | bytes], entrypoint: str) -> tuple[int, str]:
+        await self.put_files_async(files)
+        error_code, output = await self.execute_python_script_async(entrypoint)
         return error_code, output
 
-    def execute_pip_install(self, packages: set[str]) -> str:
-        outputs = []
+    async def execute_python_script_async(self, file_path: str) -> tuple[int, str]:
+        error_code, output = await self.execute_bash_string_async(f"python {file_path}")
+        return error_code, output
+
+    async def execute_pip_install_async(self, packages: set[str]) -> str:
+        missing_packages = packages - self.installed_packages
+        if not missing_packages:
+            return self._pip_install_report({package: 0 for package in packages})
+        await self._wait_for_container_async()
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(resource_hub.long_running_executor, self._use_cached_image, missing_packages):
+            return self._pip_install_report({package: 0 for package in packages})
+
+        exit_code, _output = await self.execute_bash_string_async(
+            self._pip_install_command(packages), config.PIP_INSTALL_TIMEOUT
+        )
+        if exit_code == 0:
+            self._record_installed_packages(packages)
+            return self._pip_install_report({package: 0 for package in packages})
+
+        # pip installs all or nothing, so retry one by one to find out which packages failed
+        exit_codes = {}
         for package in packages:
-            install_command = f"pip install {package} -v"
-            exit_code, _output = self.execute_bash_string(install_command)
+            exit_codes[package], output = await self.execute_bash_string_async(
+                self._pip_install_command({package}), config.PIP_INSTALL_TIMEOUT
+            )
+            self._record_failed_install(package, exit_codes[package], output)
+        installed_packages = {package for package, exit_code in exit_codes.items() if exit_code == 0}
+        if installed_packages:
+            self._record_installed_packages(installed_packages)
+        return self._pip_install_report(exit_codes)
+
+    def _use_cached_image(self, packages: set[str]) -> bool:
+        # only a container nothing has run in yet can be swapped for one started from a cached image
+        if self.has_user_state or not self.container:
+            return False
+        required_packages = self.installed_packages | packages
+        image = image_cache.lookup(required_packages)
+        if image is None:
+            return False
+
+        logger.info(f"Switching to cached image {image} for packages {sorted(required_packages)}.")
+        try:
+            # this session still holds its current container, so never wait for a slot a full pool cannot free
+            container = container_pool.lease(image=image, timeout=0)
+        except (TimeoutError, DockerException) as e:
+            # the pool is full or the image was evicted since the lookup; a plain pip install still works
+            logger.info(f"Installing packages instead of switching to cached image {image}: {e}")
+            return False
+        with self._lease_lock:
+            previous_container = None if self._removed else self.container
+            if previous_container is not None:
+                self.container = container
+        container_pool.release(previous_container or container)
+        if previous_container is None:
+            return False
+        self.installed_packages = required_packages
+        return True
+
+    def find_local_modules(self, modules: set[str]) -> set[str]:
+        # /app is importable as the package app, and user code can create modules there without uploading them
+        top_level_modules = {module.split(".")[0] for module in modules} - self.local_modules - {"app"}
+        names = sorted(name for name in top_level_modules if name.isidentifier())
+        self._wait_for_container()
+        if names and self.container and self.has_user_state:
+            try:
+                exit_code, output = self.container.exec_run(
+                    cmd=["/bin/bash", "-c", _FIND_LOCAL_MODULES_COMMAND, "bash", *names]
+                )
+            except DockerException as e:
+                logger.warning(f"Failed to look up local modules: {e}")
+            else:
+                if exit_code == 0:
+                    self.local_modules |= set(output.decode().split())
+        return self.local_modules | {"app"}
+
+    async def find_local_modules_async(self, modules: set[str]) -> set[str]:
+        return await asyncio.get_running_loop().run_in_executor(resource_hub.executor, self.find_local_modules, modules)
+
+    def _record_local_modules(self, files: dict[str, str | bytes], directory: str) -> None:
+        for name in files:
+            path = PurePosixPath(directory) / name
+            if path.parent != PurePosixPath("/app") and PurePosixPath("/app") not in path.parents:
+                continue
+            relative_parts = path.relative_to("/app").parts
+            if len(relative_parts) > 1:
+                self.local_modules.add(relative_parts[0])
+            elif path.suffix == ".py":
+                self.local_modules.add(path.stem)
+
+    def _record_installed_packages(self, packages: set[str]) -> None:
+        self.installed_packages |= packages
+        installed_packages = set(self.installed_packages)
+        resource_hub.long_running_executor.submit(
+            image_cache.build, installed_packages, self._pip_install_command(installed_packages)
+        )
 
+    def _get_kernel(self) -> "PythonKernel":
+        self._wait_for_container()
+        self.has_user_state = True
+        if self.kernel is None or self.kernel.container is not self.container:
+            self.kernel = PythonKernel(self.container)
+        return self.kernel
+
+    def _create_exec_instance(self, command: str) -> "ExecInstance":
+        logger.debug(f"Executing bash command: {command}")
+
+        encoded_command = base64.b64encode(command.encode()).decode()
+        command_str = f"echo {encoded_command} | base64 --decode | /bin/bash"
+
+        return ExecInstance(self.container, command_str)
+
+    @staticmethod
+    def _build_archive(files: dict[str, str | bytes]) -> bytes:
+        buffer = BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            for name, content in files.items():
+                data = content.encode() if isinstance(content, str) else content
+                tar_info = tarfile.TarInfo(name=name.lstrip("/"))
+                tar_info.size = len(data)
+                tar_info.mode = 0o644
+                tar_info.mtime = int(time())
+                tar.addfile(tar_info, BytesIO(data))
+        return buffer.getvalue()
+
+    @staticmethod
+    def _read_archive(archive: bytes, names: set[str] | None) -> dict[str, bytes]:
+        files: dict[str, bytes] = {}
+        with tarfile.open(fileobj=BytesIO(archive), mode="r") as tar:
+            for member in tar.getmembers():
+                if not member.isfile():
+                    continue
+                # get_archive prefixes every member with the requested directory's own name
+                relative_name = str(PurePosixPath(*PurePosixPath(member.name).parts[1:]))
+                if names is not None and relative_name not in names:
+                    continue
+                extracted = tar.extractfile(member)
+                if extracted:
+                    files[relative_name] = extracted.read()
+        return files
+
+    @staticmethod
+    def _new_script_path() -> str:
+        filename = f"script_{datetime.now().strftime('%Y%m%d%H%M%S')}.py"
+        return f"/app/{filename}"
+
+    @staticmethod
+    def _pip_install_command(packages: set[str]) -> str:
+        package_args = " ".join(shlex.quote(package) for package in sorted(packages))
+        return f"pip install --disable-pip-version-check {package_args}"
+
+    @staticmethod
+    def _record_failed_install(package: str, exit_code: int, output: str) -> None:
+        if exit_code != 0 and any(marker in output for marker in config.PIP_UNAVAILABLE_MARKERS):
+            package_index.mark_failed(package)
+
+    @staticmethod
+    def _pip_install_report(exit_codes: dict[str, int]) -> str:
+        outputs = []
+        for package, exit_code in sorted(exit_codes.items()):
             if exit_code != 0:
                 outputs.append(f"Failed to install package {package}")
             else:
                 outputs.append(f"Successfully installed package {package}")
-
         return "\n".join(outputs)
 
     def _wait_for_container(self) -> None:
         retries = 20
-        while retries > 0:
+        while retries > 0 and not self.lease_failed:
             if self.container:
                 return
             retries -= 1
             sleep(1)
         logger.warning("Failed to start container.")
 
+    async def _wait_for_container_async(self) -> None:
+        retries = 20
+        while retries > 0 and not self.lease_failed:
+            if self.container:
+                return
+            retries -= 1
+            await asyncio.sleep(1)
+        logger.warning("Failed to start container.")
+
 
 class ExecInstance:
+    _OUTPUT_END = object()
+
     def __init__(self, container, command) -> None:
         self.container = container
         self.command = command
         self.exec_id = None
         self.output_generator = None
+        self.pid_file = f"/tmp/exec_{uuid.uuid4().hex}.pid"
+        self.exit_code: int | None = None
+        self.timed_out = False
+        self.finished = threading.Event()
 
     def start(self) -> None:
+        # setsid puts the command in its own process group so the watchdog can kill all of it on timeout.
+        wrapped_command = f"trap 'rm -f {self.pid_file}' EXIT; echo $$ > {self.pid_file}; {self.command}"
         exec_instance = self.container.client.api.exec_create(
-            self.container.id, cmd=["/bin/bash", "-c", self.command], workdir="/app"
+            self.container.id, cmd=["setsid", "-w", "/bin/bash", "-c", wrapped_command], workdir="/app"
         )
         self.exec_id = exec_instance["Id"]
-        self.output_generator = self.container.client.api.exec_start(self.exec_id, stream=True, detach=True)
+        self.output_generator = self.container.client.api.exec_start(self.exec_id, stream=True)
 
-    def monitor(self, timeout) -> None:
-        start_time = datetime.now()
-        while True:
-            sleep(1)
-            exec_inspect = self.container.client.api.exec_inspect(self.exec_id)
-            if exec_inspect["Running"]:
-                if (datetime.now() - start_time).seconds > timeout:
-                    self.container.client.api.close(self.exec_id)
-                    return
-            else:
-                break
+    def inspect(self) -> dict:
+        return self.container.client.api.exec_inspect(self.exec_id)
+
+    def kill(self) -> None:
+        self.timed_out = True
+        self.container.exec_run(
+            cmd=["/bin/bash", "-c", f"kill -KILL -- -$(cat {self.pid_file}) 2>/dev/null; rm -f {self.pid_file}"]
+        )
+
+    def set_finished(self, exit_code: int | None) -> None:
+        if exit_code is not None:
+            self.exit_code = exit_code
+        self.finished.set()
 
     def get_output(self) -> Generator[str, None, None]:
         if not self.output_generator:
             return
         for line in self.output_generator:
             yield line.decode("utf-8")
+        exec_watchdog.mark_finished(self)
 
     def get_exit_code(self) -> int:
-        exec_inspect = self.container.client.api.exec_inspect(self.exec_id)
-        return exec_inspect["ExitCode"]
-
-    def get_output_string(self) -> str:
-        output_lines = list(self.get_output())
+        if self.exit_code is None:
+            self.exit_code = self.inspect()["ExitCode"]
+        return self.exit_code
+
+    async def start_async(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(resource_hub.executor, self.start)
+
+    async def get_output_async(self) -> AsyncGenerator[str, None]:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=config.EXEC_OUTPUT_QUEUE_SIZE)
+        stop_event = threading.Event()
+
+        def put_threadsafe(item: object) -> None:
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def pump_output() -> None:
+            item: object = self._OUTPUT_END
+            try:
+                for line in self.get_output():
+                    if stop_event.is_set():
+                        return
+                    put_threadsafe(line)
+            except Exception as e:
+                item = e
+            if not stop_event.is_set():
+                put_threadsafe(item)
+
+        loop.run_in_executor(resource_hub.long_running_executor, pump_output)
+        try:
+            while True:
+                item = await queue.get()
+                if item is self._OUTPUT_END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop_event.set()
+            while not queue.empty():
+                queue.get_nowait()
+
+    async def get_exit_code_async(self) -> int:
+        return await asyncio.get_running_loop().run_in_executor(resource_hub.executor, self.get_exit_code)
+
+    async def get_output_string_async(self) -> str:
+        output_lines = [line async for line in self.get_output_async()]
         return "".join(output_lines)
+
+
+class PythonKernel:
+    KERNEL_SOURCE = Path(__file__).parent / "sandbox_kernel.py"
+    KERNEL_PATH = "/opt/shinygpt/sandbox_kernel.py"
+    PID_FILE = "/opt/shinygpt/sandbox_kernel.pid"
+    _FRAME_HEADER = struct.Struct(">BxxxL")
+    _STDERR = 2
+
+    def __init__(self, container) -> None:
+        self.container = container
+        self._socket = None
+        self._receive_buffer = b""
+        self._stdout_buffer = b""
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return self._socket is not None
+
+    def start(self) -> None:
+        logger.info(f"Starting Python kernel in container {self.container.short_id}.")
+        kernel_archive = DockerManager._build_archive({self.KERNEL_PATH: self.KERNEL_SOURCE.read_bytes()})
+        self.container.put_archive("/", kernel_archive)
+
+        api = self.container.client.api
+        command = f"echo $$ > {self.PID_FILE}; exec python -u {self.KERNEL_PATH}"
+        exec_instance = api.exec_create(
+            self.container.id, cmd=["/bin/bash", "-c", command], stdin=True, workdir="/app"
+        )
+        self._socket = api.exec_start(exec_instance["Id"], socket=True)
+        self._receive_buffer = b""
+        self._stdout_buffer = b""
+
+        self._raw_socket().settimeout(config.PYTHON_KERNEL_START_TIMEOUT)
+        frame = self._next_frame()
+        if frame.get("status") != "ready":
+            self.close()
+            raise RuntimeError(f"Python kernel failed to start: {frame}")
+
+    def execute(self, code: str) -> tuple[int, str]:
+        with self._lock:
+            if not self.is_running:
+                self.start()
+
+            request_id = uuid.uuid4().hex
+            self._send({"id": request_id, "code": code})
+
+            output: list[str] = []
+            deadline = monotonic() + config.PYTHON_KERNEL_TIMEOUT
+            interrupted = False
+            while True:
+                try:
+                    self._raw_socket().settimeout(max(0.1, deadline - monotonic()))
+                    frame = self._next_frame()
+                except TimeoutError:
+                    if interrupted:
+                        self.close()
+                        output.append("Python kernel stopped responding and will be restarted.\n")
+                        return 1, "".join(output)
+                    logger.warning(f"Python kernel cell exceeded {config.PYTHON_KERNEL_TIMEOUT}s, interrupting.")
+                    self.interrupt()
+                    interrupted = True
+                    deadline = monotonic() + config.PYTHON_KERNEL_INTERRUPT_GRACE
+                    continue
+                except (EOFError, OSError):
+                    self.close()
+                    output.append("Python kernel exited unexpectedly.\n")
+                    return 1, "".join(output)
+
+                if "data" in frame:
+                    output.append(frame["data"])
+                elif frame.get("id") == request_id and "status" in frame:
+                    return (0 if frame["status"] == "ok" else 1), "".join(output)
+
+    def interrupt(self) -> None:
+        self.container.exec_run(cmd=["/bin/bash", "-c", f"kill -INT $(cat {self.PID_FILE}) 2>/dev/null"])
+
+    def close(self) -> None:
+        if self._socket is None:
+            return
+        try:
+            self._raw_socket().close()
+            self.container.exec_run(cmd=["/bin/bash", "-c", f"kill -KILL $(cat {self.PID_FILE}) 2>/dev/null"])
+        except Exception as e:
+            logger.warning(f"Failed to stop Python kernel cleanly: {e}")
+        self._socket = None
+
+    def _raw_socket(self):
+        return getattr(self._socket, "_sock", self._socket)
+
+    def _send(self, message: dict) -> None:
+        self._raw_socket().sendall((json.dumps(message) + "\n").encode())
+
+    def _next_frame(self) -> dict:
+        # Docker multiplexes the exec's stdout and stderr; protocol frames arrive as JSON lines on stdout
+        # and anything written straight to stderr is passed through as output.
+        while True:
+            newline = self._stdout_buffer.find(b"\n")
+            if newline >= 0:
+                line, self._stdout_buffer = self._stdout_buffer[:newline], self._stdout_buffer[newline + 1 :]
+                return json.loads(line)
+
+            stream, size = self._FRAME_HEADER.unpack(self._receive_exactly(self._FRAME_HEADER.size))
+            data = self._receive_exactly(size)
+            if stream == self._STDERR:
+                return {"stream": "stderr", "data": data.decode("utf-8", errors="replace")}
+            self._stdout_buffer += data
+
+    def _receive_exactly(self, size: int) -> bytes:
+        while len(self._receive_buffer) < size:
+            chunk = self._raw_socket().recv(max(4096, size - len(self._receive_buffer)))
+            if not chunk:
+                raise EOFError("Python kernel closed its output stream")
+            self._receive_buffer += chunk
+        data, self._receive_buffer = self._receive_buffer[:size], self._receive_buffer[size:]
+        return data
@@ -0,0 +1,118 @@
+# exec_watchdog.py
+import heapq
+import itertools
+import logging
+import threading
+from time import monotonic
+from typing import TYPE_CHECKING
+
+from components.config import config
+
+if TYPE_CHECKING:
+    from components.docker_interface import ExecInstance
+
+logger = logging.getLogger(__name__)
+
+
+class ExecWatchdog:
+    def __init__(self) -> None:
+        self._deadlines: list[tuple[float, int, float, "ExecInstance"]] = []
+        self._live: dict[str, "ExecInstance"] = {}
+        self._poll_order: list[str] = []
+        self._poll_offset = 0
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.completed_total = 0
+        self.timed_out_total = 0
+
+    @property
+    def active_exec_count(self) -> int:
+        return len(self._live)
+
+    def metrics(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "active_execs": len(self._live),
+                "completed_execs_total": self.completed_total,
+                "timed_out_execs_total": self.timed_out_total,
+            }
+
+    def watch(self, exec_instance: "ExecInstance", timeout: float = config.DOCKET_DETACH_TIMEOUT) -> None:
+        deadline = monotonic() + timeout
+        with self._lock:
+            self._live[exec_instance.exec_id] = exec_instance
+            self._poll_order.append(exec_instance.exec_id)
+            heapq.heappush(self._deadlines, (deadline, next(self._sequence), timeout, exec_instance))
+            self._ensure_thread()
+        self._wakeup.set()
+
+    def mark_finished(self, exec_instance: "ExecInstance", exit_code: int | None = None) -> None:
+        with self._lock:
+            if self._live.pop(exec_instance.exec_id, None) is None:
+                return
+            self.completed_total += 1
+        exec_instance.set_finished(exit_code)
+
+    def _ensure_thread(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="exec-watchdog", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        next_poll = monotonic()
+        while True:
+            now = monotonic()
+            if now >= next_poll:
+                self._poll_batch()
+                next_poll = now + config.EXEC_WATCHDOG_POLL_INTERVAL
+            self._enforce_deadlines()
+
+            with self._lock:
+                next_deadline = self._deadlines[0][0] if self._deadlines else None
+                idle = not self._live
+            wait_until = next_poll if next_deadline is None else min(next_poll, next_deadline)
+            self._wakeup.wait(None if idle else max(0.0, wait_until - monotonic()))
+            self._wakeup.clear()
+
+    def _poll_batch(self) -> None:
+        with self._lock:
+            self._poll_order = [exec_id for exec_id in self._poll_order if exec_id in self._live]
+            if not self._poll_order:
+                return
+            start = self._poll_offset % len(self._poll_order)
+            batch_ids = (self._poll_order[start:] + self._poll_order[:start])[: config.EXEC_WATCHDOG_BATCH_SIZE]
+            self._poll_offset = start + len(batch_ids)
+            batch = [self._live[exec_id] for exec_id in batch_ids]
+
+        for exec_instance in batch:
+            try:
+                exec_inspect = exec_instance.inspect()
+            except Exception as e:
+                logger.warning(f"Failed to inspect exec {exec_instance.exec_id}: {e}")
+                continue
+            if not exec_inspect["Running"]:
+                self.mark_finished(exec_instance, exec_inspect["ExitCode"])
+
+    def _enforce_deadlines(self) -> None:
+        now = monotonic()
+        expired: list[tuple[float, "ExecInstance"]] = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _deadline, _sequence, timeout, exec_instance = heapq.heappop(self._deadlines)
+                if self._live.pop(exec_instance.exec_id, None) is not None:
+                    self.timed_out_total += 1
+                    expired.append((timeout, exec_instance))
+
+        for timeout, exec_instance in expired:
+            logger.warning(f"Exec {exec_instance.exec_id} exceeded its {timeout}s timeout, killing it.")
+            try:
+                exec_instance.kill()
+            except Exception as e:
+                logger.warning(f"Failed to kill exec {exec_instance.exec_id}: {e}")
+            exec_instance.set_finished(None)
+
+
+exec_watchdog = ExecWatchdog()
@@ -0,0 +1,173 @@
+# host_router.py
+import asyncio
+import itertools
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import monotonic
+from typing import AsyncIterator
+
+import httpx
+
+from components.config import config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class InferenceHost:
+    host: str
+    port: int
+    slots: int
+    in_flight: int = 0
+    healthy: bool = False
+    models: list[str] = field(default_factory=list)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    @property
+    def load(self) -> float:
+        return self.in_flight / self.slots
+
+    def serves(self, model_name: str) -> bool:
+        # llama.cpp reports the GGUF path it was started with as the model id
+        return any(model_name in Path(model_id).name for model_id in self.models)
+
+
+class HostRouter:
+    def __init__(self, hostnames_file: Path = config.HOSTNAMES_FILE) -> None:
+        self.hostnames_file = hostnames_file
+        self._hosts: list[InferenceHost] | None = None
+        self._refreshed_at: float | None = None
+        self._refresh_task: asyncio.Task | None = None
+        self._http_client: httpx.AsyncClient | None = None
+        self._slots: asyncio.Condition | None = None
+        self._tie_breaker = itertools.count()
+
+    @property
+    def hosts(self) -> list[InferenceHost]:
+        if self._hosts is None:
+            self._hosts = self._load_hosts()
+        return self._hosts
+
+    def metrics(self) -> dict[str, int]:
+        return {
+            "inference_hosts_healthy": sum(host.healthy for host in self.hosts),
+            "inference_slots_total": sum(host.slots for host in self.hosts if host.healthy),
+            "inference_slots_in_use": sum(host.in_flight for host in self.hosts),
+        }
+
+    @asynccontextmanager
+    async def lease(self, model_name: str) -> AsyncIterator[str | None]:
+        # Yields the URL of the least loaded host that serves the model, waiting for a free slot when all are
+        # busy, or None when no host serves it so the caller can fall back to a server on this machine.
+        await self._refresh_if_stale()
+        if not any(host.healthy and host.serves(model_name) for host in self.hosts):
+            yield None
+            return
+
+        slots = self._get_slots()
+        async with slots:
+            while True:
+                candidates = [host for host in self.hosts if host.healthy and host.serves(model_name)]
+                free = [host for host in candidates if host.in_flight < host.slots]
+                if free or not candidates:
+                    break
+                await slots.wait()
+            if not candidates:
+                host = None
+            else:
+                # rotate the starting point so equally loaded hosts take turns
+                offset = next(self._tie_breaker) % len(free)
+                host = min(free[offset:] + free[:offset], key=lambda item: item.load)
+                host.in_flight += 1
+        if host is None:
+            yield None
+            return
+
+        try:
+            yield host.url
+        finally:
+            async with slots:
+                host.in_flight -= 1
+                slots.notify_all()
+
+    def routes(self, url: str) -> bool:
+        return any(host.url == url for host in self.hosts)
+
+    async def mark_unhealthy(self, url: str) -> bool:
+        # Called when a request to a routed host fails, so new requests avoid it until the next probe finds it
+        # healthy again. Returns False for URLs that do not belong to a routed host.
+        host = next((host for host in self.hosts if host.url == url), None)
+        if host is None:
+            return False
+        if host.healthy:
+            logger.warning(f"Inference host {host.host}:{host.port} failed a request, marking it unavailable.")
+        host.healthy = False
+        slots = self._get_slots()
+        async with slots:
+            slots.notify_all()
+        return True
+
+    def _get_slots(self) -> asyncio.Condition:
+        if self._slots is None:
+            self._slots = asyncio.Condition()
+        return self._slots
+
+    def _load_hosts(self) -> list[InferenceHost]:
+        hosts = []
+        try:
+            lines = self.hostnames_file.read_text().splitlines()
+        except FileNotFoundError:
+            return hosts
+        for line in lines:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split(":")
+            try:
+                if len(parts) == 2:
+                    hosts.append(InferenceHost(parts[0], config.INFERENCE_HOST_DEFAULT_PORT, int(parts[1])))
+                elif len(parts) == 3:
+                    hosts.append(InferenceHost(parts[0], int(parts[1]), int(parts[2])))
+                else:
+                    raise ValueError(line)
+            except ValueError:
+                logger.warning(f"Ignoring malformed entry '{line}' in {self.hostnames_file}.")
+        return [host for host in hosts if host.slots > 0]
+
+    async def _refresh_if_stale(self) -> None:
+        stale = self._refreshed_at is None or monotonic() - self._refreshed_at > config.INFERENCE_HOST_REFRESH_INTERVAL
+        if stale and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.ensure_future(self.refresh())
+        # only the first probe is awaited; later ones run in the background while requests use the previous result
+        if self._refreshed_at is None and self._refresh_task is not None:
+            await asyncio.shield(self._refresh_task)
+
+    async def refresh(self) -> None:
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(timeout=config.LLM_HEALTH_CHECK_TIMEOUT)
+        await asyncio.gather(*(self._probe(host) for host in self.hosts))
+        self._refreshed_at = monotonic()
+        slots = self._get_slots()
+        async with slots:
+            slots.notify_all()
+
+    async def _probe(self, host: InferenceHost) -> None:
+        assert self._http_client is not None
+        try:
+            response = await self._http_client.get(f"{host.url}/models")
+            response.raise_for_status()
+            host.models = [model["id"] for model in response.json().get("data", [])]
+        except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+            if host.healthy:
+                logger.warning(f"Inference host {host.host}:{host.port} is unavailable: {e}")
+            host.healthy = False
+            return
+        host.healthy = True
+
+
+host_router = HostRouter()
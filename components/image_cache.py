@@ -0,0 +1,158 @@
+# image_cache.py
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from docker.errors import DockerException
+from docker.models.containers import Container
+
+from components.config import config
+from components.resource_hub import resource_hub
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedImage:
+    reference: str
+    packages: frozenset[str]
+    size: int
+
+
+class ImageCache:
+    CACHE_LABEL = "shinygpt.image-cache"
+    PACKAGES_LABEL = "shinygpt.packages"
+
+    def __init__(self, repository: str = config.IMAGE_CACHE_REPOSITORY) -> None:
+        self.repository = repository
+        self._images: OrderedDict[str, CachedImage] = OrderedDict()
+        self._pending: set[str] = set()
+        self._base_image_size: int | None = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def tag_for(packages: set[str] | frozenset[str]) -> str:
+        package_key = ",".join(sorted(package.lower() for package in packages))
+        return hashlib.sha256(package_key.encode()).hexdigest()[:32]
+
+    @property
+    def total_size(self) -> int:
+        return sum(image.size for image in self._images.values())
+
+    def lookup(self, packages: set[str]) -> str | None:
+        self._load_existing()
+        tag = self.tag_for(packages)
+        with self._lock:
+            cached_image = self._images.get(tag)
+            if cached_image is None:
+                return None
+            self._images.move_to_end(tag)
+            return cached_image.reference
+
+    def build(self, packages: set[str], install_command: str) -> None:
+        # Built in a throwaway container that has run nothing but the install, so no session's files or processes
+        # can end up in an image that other sessions start from.
+        self._load_existing()
+        tag = self.tag_for(packages)
+        with self._lock:
+            if tag in self._images or tag in self._pending:
+                return
+            self._pending.add(tag)
+
+        package_list = ",".join(sorted(package.lower() for package in packages))
+        container: Container | None = None
+        try:
+            logger.info(f"Building cached sandbox image {self.repository}:{tag} ({package_list}).")
+            container = resource_hub.docker_client.containers.run(
+                image=config.SANDBOX_IMAGE,
+                detach=True,
+                tty=True,
+                stdin_open=True,
+                volumes={config.PIP_CACHE_VOLUME: {"bind": config.PIP_CACHE_PATH, "mode": "rw"}},
+                environment={"PIP_CACHE_DIR": config.PIP_CACHE_PATH},
+            )
+            exit_code, output = container.exec_run(
+                cmd=["timeout", str(config.PIP_INSTALL_TIMEOUT), "/bin/bash", "-c", install_command]
+            )
+            if exit_code != 0:
+                logger.warning(f"Failed to install {package_list} for a cached image: {output!r}")
+                return
+            image = container.commit(
+                repository=self.repository,
+                tag=tag,
+                pause=False,
+                conf={"Labels": {self.CACHE_LABEL: "1", self.PACKAGES_LABEL: package_list}},
+            )
+            cached_image = CachedImage(f"{self.repository}:{tag}", frozenset(packages), self._layer_size(image.attrs))
+        except DockerException as e:
+            logger.warning(f"Failed to build cached sandbox image {self.repository}:{tag}: {e}")
+            return
+        finally:
+            with self._lock:
+                self._pending.discard(tag)
+            if container is not None:
+                self._remove_container(container)
+
+        with self._lock:
+            self._images[tag] = cached_image
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            candidates = list(self._images.items())
+        for tag, cached_image in candidates:
+            with self._lock:
+                over_count = len(self._images) > config.IMAGE_CACHE_MAX_IMAGES
+                over_size = self.total_size > config.IMAGE_CACHE_MAX_BYTES
+                if not (over_count or over_size):
+                    return
+
+            logger.info(f"Evicting cached sandbox image {cached_image.reference}.")
+            try:
+                resource_hub.docker_client.images.remove(cached_image.reference)
+            except DockerException as e:
+                # keep tracking it, most likely a running container still uses it, and try the next oldest
+                logger.warning(f"Failed to remove cached image {cached_image.reference}: {e}")
+                continue
+            with self._lock:
+                self._images.pop(tag, None)
+
+    @staticmethod
+    def _remove_container(container: Container) -> None:
+        try:
+            container.remove(force=True)
+        except DockerException as e:
+            logger.warning(f"Failed to remove image build container {container.short_id}: {e}")
+
+    def _load_existing(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                images = resource_hub.docker_client.images.list(filters={"label": self.CACHE_LABEL})
+            except DockerException as e:
+                logger.warning(f"Failed to list cached sandbox images: {e}")
+                return
+            for image in sorted(images, key=lambda item: item.attrs.get("Created", "")):
+                labels = image.labels or {}
+                packages = frozenset(filter(None, labels.get(self.PACKAGES_LABEL, "").split(",")))
+                tag = self.tag_for(packages)
+                self._images[tag] = CachedImage(f"{self.repository}:{tag}", packages, self._layer_size(image.attrs))
+            self._loaded = True
+
+    def _layer_size(self, image_attrs: dict) -> int:
+        # committed images share the sandbox base layers, so only count what was added on top of them
+        if self._base_image_size is None:
+            try:
+                self._base_image_size = resource_hub.docker_client.images.get(config.SANDBOX_IMAGE).attrs["Size"]
+            except DockerException:
+                self._base_image_size = 0
+        return max(0, image_attrs.get("Size", 0) - self._base_image_size)
+
+
+image_cache = ImageCache()
@@ -1,15 +1,9 @@
 # llm_communication.py
-import json
 import logging
-import subprocess
-import time
-from asyncio import sleep
-from glob import glob
-from pathlib import Path
-from typing import AsyncGenerator, Generator
-from urllib.parse import urlparse
+from contextlib import aclosing, asynccontextmanager
+from dataclasses import replace
+from typing import AsyncGenerator, AsyncIterator
 
-import requests
 import openai
 from openai import AsyncStream
 from openai.types.chat import (
@@ -19,9 +13,12 @@ from openai.types.chat import (
     ChatCompletionToolMessageParam,
     ChatCompletionUserMessageParam,
 )
-from transformers import GPT2Tokenizer  # type: ignore
-
-from components.config import config
+from components.config import LLMApi, config
+from components.conversation_history import ROLE_ASSISTANT, ConversationHistory
+from components.host_router import host_router
+from components.model_server import model_server_supervisor
+from components.resource_hub import resource_hub
+from components.tokenization import token_counter
 
 logger = logging.getLogger(__name__)
 
@@ -35,41 +32,85 @@ MessageParamType = (
 
 
 class LLMClient:
-    def __init__(self) -> None:
-        self.models = {}
-        for llm_model_name, llm_api in config.LLM_APIS.items():
-            llm_api_url = llm_api.url
-            llm_api_key = llm_api.key
-            self.models[llm_model_name] = openai.AsyncOpenAI(
-                base_url=llm_api_url,
-                api_key=llm_api_key,
+    async def send_prompt(
+        self, prompt_text: str, model_name: str, history: ConversationHistory | None = None
+    ) -> AsyncGenerator[str, None]:
+        failed_urls: set[str] = set()
+        while True:
+            async with self._serving(model_name) as llm_api:
+                streamed = False
+                try:
+                    async with aclosing(self._stream_completion(prompt_text, model_name, llm_api, history)) as chunks:
+                        async for chunk in chunks:
+                            streamed = True
+                            yield chunk
+                    return
+                except openai.APIConnectionError as e:
+                    # only raised for routed hosts; _stream_completion logs and ends the stream for everything else
+                    await host_router.mark_unhealthy(llm_api.url)
+                    if streamed or llm_api.url in failed_urls:
+                        # part of the response was already sent, retrying would repeat it
+                        logger.warning(f"Inference host {llm_api.url} failed while streaming {model_name}: {e}")
+                        return
+                    failed_urls.add(llm_api.url)
+                    logger.warning(f"Retrying {model_name} on another host after {llm_api.url} failed: {e}")
+
+    async def summarize(self, transcript: str, model_name: str) -> str:
+        async with self._serving(model_name) as llm_api:
+            response = await resource_hub.get_llm_client(llm_api).chat.completions.create(
+                model=model_name,
+                messages=[
+                    ChatCompletionSystemMessageParam(role="system", content=config.HISTORY_SUMMARY_PROMPT),
+                    ChatCompletionUserMessageParam(role="user", content=transcript),
+                ],
+                max_tokens=config.HISTORY_SUMMARY_MAX_TOKENS,
+                **self.completion_options(llm_api),
             )
-        self.tokenizer = GPT2Tokenizer.from_pretrained("gpt2")
+        return response.choices[0].message.content or ""
 
-    async def send_prompt(self, prompt_text: str, model_name: str) -> AsyncGenerator[str, None]:
+    @asynccontextmanager
+    async def _serving(self, model_name: str) -> AsyncIterator[LLMApi]:
         llm_api = config.LLM_APIS[model_name]
+        if not llm_api.local:
+            yield llm_api
+            return
+
+        async with host_router.lease(model_name) as host_url:
+            if host_url is not None:
+                yield replace(llm_api, url=host_url)
+                return
 
-        if "local" in llm_api.url:
-            await self.check_and_start_local_server(model_name)
+        async with model_server_supervisor.lease(model_name) as url:
+            yield replace(llm_api, url=url)
 
+    async def _stream_completion(
+        self, prompt_text: str, model_name: str, llm_api: LLMApi, history: ConversationHistory | None
+    ) -> AsyncGenerator[str, None]:
+        system_tokens = token_counter.count_system_message(model_name)
+        prompt_tokens = token_counter.count(prompt_text, model_name)
         messages: list[MessageParamType] = [
-            ChatCompletionSystemMessageParam(role="system", content=self._get_system_message()),
-            ChatCompletionUserMessageParam(role="user", content=prompt_text),
+            ChatCompletionSystemMessageParam(role="system", content=self.get_system_message()),
         ]
+        history_tokens = 0
+        if history is not None:
+            reserved_tokens = llm_api.max_output_tokens or config.HISTORY_RESERVED_OUTPUT_TOKENS
+            budget = llm_api.max_context_tokens - reserved_tokens - system_tokens
+            summary_tokens = history.summary_tokens(model_name)
+            if history.summary and summary_tokens <= budget - prompt_tokens:
+                messages.append(ChatCompletionSystemMessageParam(role="system", content=history.summary_message))
+                history_tokens += summary_tokens
+            for turn in history.context(model_name, budget, prompt_tokens) if budget > prompt_tokens else []:
+                if turn.role == ROLE_ASSISTANT:
+                    messages.append(ChatCompletionAssistantMessageParam(role="assistant", content=turn.text))
+                else:
+                    messages.append(ChatCompletionUserMessageParam(role="user", content=turn.text))
+                history_tokens += turn.tokens(model_name)
+        messages.append(ChatCompletionUserMessageParam(role="user", content=prompt_text))
+
         if llm_api.max_output_tokens:
             adjusted_max_tokens = llm_api.max_output_tokens
         else:
-            num_tokens_used = sum(
-                len(
-                    self.tokenizer.encode(
-                        message.get("content", ""),
-                        add_special_tokens=True,
-                        max_length=llm_api.max_context_tokens,
-                        truncation=True,
-                    )
-                )
-                for message in messages
-            )
+            num_tokens_used = min(system_tokens + history_tokens + prompt_tokens, llm_api.max_context_tokens)
             adjusted_max_tokens = llm_api.max_context_tokens - num_tokens_used
 
         min_tokens = int(config.MINIMUM_COMPLETION_TOKENS)
@@ -79,12 +120,13 @@ class LLMClient:
             yield message
             return
         try:
-            current_model = self.models[model_name]
+            current_model = resource_hub.get_llm_client(llm_api)
             response = await current_model.chat.completions.create(
                 model=model_name,
                 messages=messages,
                 max_tokens=adjusted_max_tokens,
                 stream=True,
+                **self.completion_options(llm_api),
             )
             if not isinstance(response, AsyncStream):
                 raise TypeError(f"Expected AsyncStream, got {type(response)}")
@@ -95,6 +137,8 @@ class LLMClient:
                     logger.warning(f"OpenAI API returned empty response: {chunk}")
 
         except Exception as e:
+            if isinstance(e, openai.APIConnectionError) and host_router.routes(llm_api.url):
+                raise
             if isinstance(e, openai.Timeout):
                 logger.warning(f"OpenAI API request timed out: {e}")
             elif isinstance(e, openai.BadRequestError):
@@ -113,61 +157,14 @@ class LLMClient:
                 raise
 
     @staticmethod
-    def _get_system_message(language: str = "python") -> str:
-        system_message = config.SYSTEM_MESSAGES[language]
-        return system_message
-
-    async def check_and_start_local_server(self, model_name: str) -> None:
-        model_url = config.LLM_APIS[model_name].url
-
-        try:
-            requests.get(f"{model_url}/health")
-        except requests.exceptions.ConnectionError:
-            process = self.start_local_server(model_name)
-            await self.wait_for_model_to_load(process)
-
-    @staticmethod
-    def start_local_server(model_name: str) -> subprocess.Popen:
-        model_url = str(config.LLM_APIS[model_name].url)
-        model_port = urlparse(model_url).port
-        model_port_str = str(model_port)
-
-        script_path = Path(__file__).parent
-        project_root = script_path.parent.absolute()
-        server_binary = project_root / "external" / "llama.cpp" / "server"
-        model_pattern = str(project_root / "data" / "llm_files" / (model_name + "*" + "Q4" + "*.gguf"))
-
-        if len(model_pattern) == 0:
-            raise FileNotFoundError(f"Model file not found for {model_name}")
-        model_file = glob(model_pattern)[0]
-        command = [str(server_binary), "--port", model_port_str, "-m", model_file]
-        logger.info(f"Starting local server using '{' '.join(command)}'")
-        return subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True, start_new_session=True)
-
-    @staticmethod
-    async def wait_for_model_to_load(process: subprocess.Popen) -> None:
-        start_time = time.time()
-        while True:
-            if not process.stdout:
-                await sleep(0.1)
-                continue
-            output = process.stdout.readline().strip()
-            if output:
-                logger.info(output)
-                try:
-                    log = json.loads(output)
-                    if log.get("message") == "model loaded":
-                        break
-                except json.JSONDecodeError:
-                    pass
-            if time.time() - start_time > config.LLM_LOADING_TIMEOUT:
-                raise RuntimeError(f"Timeout waiting for model to load")
-            await sleep(0.001)
-
-        if process.poll() is not None and process.returncode != 0:
-            raise RuntimeError(f"Process exited with code {process.returncode}")
+    def completion_options(llm_api: LLMApi, cache_prompt: bool = config.LOCAL_MODEL_CACHE_PROMPT) -> dict:
+        # The system message is the same for every request, so llama.cpp can reuse the evaluated prefix
+        # kept in a slot's KV cache instead of re-evaluating it before the first token.
+        if not llm_api.local:
+            return {}
+        return {"extra_body": {"cache_prompt": cache_prompt}}
 
     @staticmethod
-    def get_model_names() -> Generator[str, None, None]:
-        for model_name in config.LLM_APIS.keys():
-            yield model_name
+    def get_system_message(language: str = "python") -> str:
+        system_message = config.SYSTEM_MESSAGES[language]
+        return system_message
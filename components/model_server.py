@@ -0,0 +1,347 @@
+# model_server.py
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from time import monotonic
+from typing import AsyncIterator
+from urllib.parse import urlparse
+
+import httpx
+
+from components.config import config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ModelServer:
+    model_name: str
+    url_template: str
+    model_file: Path
+    size_bytes: int
+    context_tokens: int
+    kv_cache_bytes_per_token: int
+    port: int | None = None
+    process: asyncio.subprocess.Process | None = None
+    resident: bool = False
+    ready: bool = False
+    startup: asyncio.Future | None = None
+    loaded: asyncio.Event = field(default_factory=asyncio.Event)
+    tasks: list[asyncio.Task] = field(default_factory=list)
+    leases: int = 0
+    last_used: float = field(default_factory=monotonic)
+    restarts: int = 0
+    stopping: bool = False
+
+    @property
+    def memory_bytes(self) -> int:
+        # the weights plus the KV cache llama.cpp allocates up front for --ctx-size tokens
+        kv_cache_bytes = self.context_tokens * config.LOCAL_MODEL_PARALLEL_SLOTS * self.kv_cache_bytes_per_token
+        return self.size_bytes + kv_cache_bytes
+
+    @property
+    def url(self) -> str:
+        parsed = urlparse(self.url_template)
+        return parsed._replace(netloc=f"{parsed.hostname}:{self.port}").geturl()
+
+    @property
+    def health_url(self) -> str:
+        parsed = urlparse(self.url_template)
+        return f"{parsed.scheme}://{parsed.hostname}:{self.port}/health"
+
+
+class ModelServerSupervisor:
+    def __init__(self) -> None:
+        self._servers: dict[str, ModelServer] = {}
+        self._http_client: httpx.AsyncClient | None = None
+        self._health_task: asyncio.Task | None = None
+        self._residency: asyncio.Condition | None = None
+
+    def metrics(self) -> dict[str, int]:
+        resident = [server for server in self._servers.values() if server.resident]
+        return {
+            "resident_local_models": len(resident),
+            "resident_local_model_bytes": sum(server.memory_bytes for server in resident),
+            "local_model_restarts_total": sum(server.restarts for server in self._servers.values()),
+        }
+
+    @asynccontextmanager
+    async def lease(self, model_name: str) -> AsyncIterator[str]:
+        # a leased model is never evicted, so a streaming completion cannot lose its server mid-response
+        server = self._get_server(model_name)
+        server.leases += 1
+        try:
+            await self._ensure_ready(server)
+            server.last_used = monotonic()
+            yield server.url
+        finally:
+            server.leases -= 1
+            server.last_used = monotonic()
+            async with self._get_residency():
+                self._get_residency().notify_all()
+
+    def _get_server(self, model_name: str) -> ModelServer:
+        llm_api = config.LLM_APIS[model_name]
+        kv_cache_bytes_per_token = llm_api.kv_cache_bytes_per_token or config.LOCAL_MODEL_KV_CACHE_BYTES_PER_TOKEN
+        server = self._servers.get(model_name)
+        if server is None:
+            model_file = self._model_file(model_name)
+            server = self._servers[model_name] = ModelServer(
+                model_name,
+                llm_api.url,
+                model_file,
+                model_file.stat().st_size,
+                llm_api.max_context_tokens,
+                kv_cache_bytes_per_token,
+            )
+        server.url_template = llm_api.url
+        server.context_tokens = llm_api.max_context_tokens
+        server.kv_cache_bytes_per_token = kv_cache_bytes_per_token
+        return server
+
+    @staticmethod
+    def _model_file(model_name: str) -> Path:
+        model_files = sorted(config.LLM_FILES_DIR.glob(f"{model_name}*Q4*.gguf"))
+        if not model_files:
+            raise FileNotFoundError(f"Model file not found for {model_name}")
+        return model_files[0]
+
+    def _get_residency(self) -> asyncio.Condition:
+        if self._residency is None:
+            self._residency = asyncio.Condition()
+        return self._residency
+
+    async def _ensure_ready(self, server: ModelServer) -> None:
+        self._ensure_health_task()
+        if server.ready:
+            return
+        # every concurrent caller waits on the same startup; shield it so one cancelled request cannot abort it
+        if server.startup is None or server.startup.done():
+            server.startup = asyncio.ensure_future(self._start(server))
+        await asyncio.shield(server.startup)
+
+    async def _start(self, server: ModelServer) -> None:
+        if not server.resident:
+            await self._admit(server)
+        try:
+            if server.process is None or server.process.returncode is not None:
+                await self._spawn(server)
+            await self._wait_until_loaded(server)
+        except BaseException:
+            await self._evict(server)
+            raise
+        server.ready = True
+        logger.info(f"Model server for {server.model_name} is ready on port {server.port}.")
+
+    async def _admit(self, server: ModelServer) -> None:
+        residency = self._get_residency()
+        async with residency:
+            while True:
+                others = [other for other in self._servers.values() if other.resident and other is not server]
+                resident_bytes = sum(other.memory_bytes for other in others)
+                if resident_bytes + server.memory_bytes <= config.LOCAL_MODEL_RAM_BUDGET or not others:
+                    break
+                evictable = sorted((other for other in others if other.leases == 0), key=lambda s: s.last_used)
+                if not evictable:
+                    logger.info(f"Waiting for a local model to become idle before loading {server.model_name}.")
+                    await residency.wait()
+                    continue
+                logger.info(f"Evicting {evictable[0].model_name} to make room for {server.model_name}.")
+                await self._evict(evictable[0])
+            if server.memory_bytes > config.LOCAL_MODEL_RAM_BUDGET:
+                logger.warning(
+                    f"Model {server.model_name} ({server.memory_bytes} bytes) exceeds the local model RAM budget."
+                )
+            server.resident = True
+
+    async def _evict(self, server: ModelServer) -> None:
+        server.stopping = True
+        server.ready = False
+        if server.process is not None:
+            await self._terminate(server.process)
+        server.process = None
+        server.port = None
+        server.resident = False
+        residency = self._get_residency()
+        if not residency.locked():
+            async with residency:
+                residency.notify_all()
+
+    async def _restart(self, server: ModelServer) -> None:
+        # detach the process first so _monitor does not schedule a second restart when it exits
+        process, server.process = server.process, None
+        if process is not None:
+            await self._terminate(process)
+        server.restarts += 1
+        await self._start(server)
+
+    @staticmethod
+    async def _terminate(process: asyncio.subprocess.Process) -> None:
+        if process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), config.LOCAL_MODEL_STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+    async def _spawn(self, server: ModelServer) -> None:
+        server.port = None
+        server.port = self._free_port()
+        command = self._server_command(server)
+        logger.info(f"Starting local server using '{' '.join(command)}'")
+        server.stopping = False
+        server.loaded.clear()
+        server.process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True,
+        )
+        server.tasks = [
+            asyncio.ensure_future(self._read_logs(server, server.process)),
+            asyncio.ensure_future(self._monitor(server, server.process)),
+        ]
+
+    @staticmethod
+    def _server_command(server: ModelServer) -> list[str]:
+        # llama.cpp splits the context between its slots, so give every slot the model's full context;
+        # each slot keeps the KV cache of its last prompt, which cache_prompt requests reuse
+        slots = config.LOCAL_MODEL_PARALLEL_SLOTS
+        return [
+            str(config.LLM_SERVER_BINARY),
+            "--port",
+            str(server.port),
+            "-m",
+            str(server.model_file),
+            "--parallel",
+            str(slots),
+            "--ctx-size",
+            str(server.context_tokens * slots),
+        ]
+
+    def _free_port(self) -> int:
+        used_ports = {server.port for server in self._servers.values() if server.port is not None}
+        for port in config.LOCAL_MODEL_PORTS:
+            if port in used_ports:
+                continue
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.bind(("127.0.0.1", port))
+                except OSError:
+                    continue
+            return port
+        raise RuntimeError("No free port left for a local model server")
+
+    async def _wait_until_loaded(self, server: ModelServer) -> None:
+        process = server.process
+        assert process is not None
+        loaded = asyncio.ensure_future(server.loaded.wait())
+        exited = asyncio.ensure_future(process.wait())
+        polled = asyncio.ensure_future(self._poll_until_healthy(server))
+        try:
+            done, _pending = await asyncio.wait(
+                {loaded, exited, polled}, timeout=config.LLM_LOADING_TIMEOUT, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            for task in (loaded, exited, polled):
+                task.cancel()
+        if not done:
+            raise RuntimeError(f"Timeout waiting for model {server.model_name} to load")
+        if exited in done:
+            raise RuntimeError(f"Model server for {server.model_name} exited with code {process.returncode}")
+
+    @staticmethod
+    async def _read_logs(server: ModelServer, process: asyncio.subprocess.Process) -> None:
+        assert process.stdout is not None
+        async for raw_line in process.stdout:
+            line = raw_line.decode(errors="replace").strip()
+            if not line:
+                continue
+            logger.info(line)
+            try:
+                log = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(log, dict) and log.get("message") == "model loaded":
+                server.loaded.set()
+
+    async def _monitor(self, server: ModelServer, process: asyncio.subprocess.Process) -> None:
+        return_code = await process.wait()
+        server.ready = False
+        if server.stopping or server.process is not process:
+            return
+        server.restarts += 1
+        logger.warning(
+            f"Model server for {server.model_name} exited with code {return_code}, "
+            f"restarting in {config.LLM_SERVER_RESTART_DELAY}s (restart {server.restarts})."
+        )
+        await asyncio.sleep(config.LLM_SERVER_RESTART_DELAY)
+        if server.stopping or server.process is not process:
+            return
+        try:
+            await self._ensure_ready(server)
+        except Exception as e:
+            logger.error(f"Failed to restart model server for {server.model_name}: {e}")
+
+    async def _poll_until_healthy(self, server: ModelServer) -> None:
+        while not await self._is_healthy(server):
+            await asyncio.sleep(config.LLM_HEALTH_POLL_INTERVAL)
+
+    async def _is_healthy(self, server: ModelServer) -> bool:
+        if server.port is None:
+            return False
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(timeout=config.LLM_HEALTH_CHECK_TIMEOUT)
+        try:
+            response = await self._http_client.get(server.health_url)
+        except httpx.HTTPError:
+            return False
+        return response.status_code == 200
+
+    def _ensure_health_task(self) -> None:
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.ensure_future(self._health_loop())
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(config.LLM_HEALTH_CHECK_INTERVAL)
+            for server in list(self._servers.values()):
+                if not server.ready:
+                    continue
+                if await self._is_healthy(server):
+                    continue
+                logger.warning(f"Model server for {server.model_name} failed its health check, restarting it.")
+                # a hung server still counts as loaded, so replace the process instead of waiting for it
+                server.ready = False
+                server.loaded.clear()
+                if server.startup is None or server.startup.done():
+                    server.startup = asyncio.ensure_future(self._restart(server))
+                    server.startup.add_done_callback(partial(self._log_restart_failure, server))
+
+    @staticmethod
+    def _log_restart_failure(server: ModelServer, startup: asyncio.Future) -> None:
+        if not startup.cancelled() and startup.exception() is not None:
+            logger.error(f"Failed to restart model server for {server.model_name}: {startup.exception()}")
+
+    def stop(self) -> None:
+        # runs from atexit, possibly after the event loop has closed, so signal the processes directly
+        for server in self._servers.values():
+            server.stopping = True
+            server.ready = False
+            if server.process is not None and server.process.returncode is None:
+                try:
+                    os.kill(server.process.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+
+model_server_supervisor = ModelServerSupervisor()
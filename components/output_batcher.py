@@ -0,0 +1,77 @@
+# output_batcher.py
+import asyncio
+from time import monotonic
+
+from channels.generic.websocket import AsyncJsonWebsocketConsumer  # type: ignore
+
+from components.config import config
+
+
+class OutputBatcher:
+    def __init__(
+        self,
+        consumer: AsyncJsonWebsocketConsumer,
+        key: str,
+        flush_interval: float = config.OUTPUT_FLUSH_INTERVAL,
+        flush_bytes: int = config.OUTPUT_FLUSH_BYTES,
+    ) -> None:
+        self.consumer = consumer
+        self.key = key
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self._buffer: list[str] = []
+        self._buffered_bytes = 0
+        self._first_flushed = False
+        self._last_flush = 0.0
+        self._send_lock = asyncio.Lock()
+        self._flush_timer: asyncio.Task | None = None
+
+    async def write(self, chunk: str) -> None:
+        if not chunk:
+            return
+        self._buffer.append(chunk)
+        self._buffered_bytes += len(chunk)
+
+        if (
+            not self._first_flushed
+            or self._buffered_bytes >= self.flush_bytes
+            or monotonic() - self._last_flush >= self.flush_interval
+        ):
+            # Waiting for the send lock here is the backpressure: a slow socket slows the producer down
+            # while everything written in the meantime is coalesced into the next frame.
+            await self.flush()
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.create_task(self._flush_later())
+
+    async def send(self, message: object) -> None:
+        async with self._send_lock:
+            await self._send_buffer()
+            await self._send_frame(message)
+
+    async def flush(self) -> None:
+        async with self._send_lock:
+            await self._send_buffer()
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        self._flush_timer = None
+        await self.flush()
+
+    async def _send_buffer(self) -> None:
+        if not self._buffer:
+            return
+        text = "".join(self._buffer)
+        self._buffer.clear()
+        self._buffered_bytes = 0
+        await self._send_frame(text)
+
+    async def _send_frame(self, message: object) -> None:
+        self._first_flushed = True
+        await self.consumer.send_json({self.key: message})
+        self._last_flush = monotonic()
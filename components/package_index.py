@@ -0,0 +1,70 @@
+# package_index.py
+import logging
+import threading
+from pathlib import Path
+from time import monotonic
+
+from components.config import config, load_toml_file
+
+logger = logging.getLogger(__name__)
+
+
+class PackageIndex:
+    def __init__(
+        self, index_file: Path = config.MODULE_DISTRIBUTIONS_FILE, local_index_file: Path | None = None
+    ) -> None:
+        self.index_file = index_file
+        self.local_index_file = local_index_file
+        self._distributions: dict[str, str] | None = None
+        self._failed_installs: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def distributions(self) -> dict[str, str]:
+        if self._distributions is None:
+            with self._lock:
+                if self._distributions is None:
+                    self._distributions = self._load_index()
+        return self._distributions
+
+    def resolve(self, modules: set[str], local_modules: set[str] | None = None) -> set[str]:
+        local_modules = local_modules or set()
+        packages = set()
+        for module in modules:
+            top_level_module = module.split(".")[0]
+            if not top_level_module or top_level_module in local_modules:
+                continue
+            package = self.distributions.get(top_level_module, top_level_module)
+            if self.has_failed(package):
+                logger.info(f"Skipping {package}, it failed to install recently.")
+                continue
+            packages.add(package)
+        return packages
+
+    def has_failed(self, package: str) -> bool:
+        with self._lock:
+            failed_at = self._failed_installs.get(package.lower())
+            if failed_at is None:
+                return False
+            if monotonic() - failed_at > config.PIP_NEGATIVE_CACHE_TTL:
+                del self._failed_installs[package.lower()]
+                return False
+            return True
+
+    def mark_failed(self, package: str) -> None:
+        with self._lock:
+            self._failed_installs[package.lower()] = monotonic()
+
+    def _load_index(self) -> dict[str, str]:
+        distributions: dict[str, str] = {}
+        for index_file in (self.index_file, self.local_index_file or config.LOCAL_MODULE_DISTRIBUTIONS_FILE):
+            if not index_file.exists():
+                continue
+            try:
+                distributions.update(load_toml_file(index_file).get("MODULES", {}))
+            except (PermissionError, RuntimeError) as e:
+                logger.warning(f"Skipping module distribution index {index_file}: {e}")
+        return distributions
+
+
+package_index = PackageIndex()
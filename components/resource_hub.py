@@ -0,0 +1,114 @@
+# resource_hub.py
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
+
+import docker
+import httpx
+import openai
+
+from components.config import LLMApi, config
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceHub:
+    def __init__(self) -> None:
+        self._docker_client: docker.DockerClient | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._long_running_executor: ThreadPoolExecutor | None = None
+        self._http_clients: dict[str, httpx.AsyncClient] = {}
+        self._llm_clients: dict[tuple[str, str], openai.AsyncOpenAI] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def docker_client(self) -> docker.DockerClient:
+        if self._docker_client is None:
+            with self._lock:
+                if self._docker_client is None:
+                    self._docker_client = docker.DockerClient(
+                        base_url=config.DOCKER_URL, max_pool_size=config.DOCKER_MAX_POOL_SIZE
+                    )
+        return self._docker_client
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=config.EXECUTOR_MAX_WORKERS, thread_name_prefix="shinygpt"
+                    )
+        return self._executor
+
+    @property
+    def long_running_executor(self) -> ThreadPoolExecutor:
+        # Output pumps, kernel executions and container starts can hold a thread for as long as user code runs,
+        # so they get their own workers and cannot starve the short control calls on the executor.
+        if self._long_running_executor is None:
+            with self._lock:
+                if self._long_running_executor is None:
+                    self._long_running_executor = ThreadPoolExecutor(
+                        max_workers=config.LONG_RUNNING_EXECUTOR_MAX_WORKERS, thread_name_prefix="shinygpt-long"
+                    )
+        return self._long_running_executor
+
+    def get_llm_client(self, llm_api: LLMApi) -> openai.AsyncOpenAI:
+        key = (llm_api.url, llm_api.key)
+        llm_client = self._llm_clients.get(key)
+        if llm_client is None:
+            with self._lock:
+                llm_client = self._llm_clients.get(key)
+                if llm_client is None:
+                    llm_client = openai.AsyncOpenAI(
+                        base_url=llm_api.url,
+                        api_key=llm_api.key,
+                        http_client=self._get_http_client(llm_api),
+                    )
+                    self._llm_clients[key] = llm_client
+        return llm_client
+
+    def _get_http_client(self, llm_api: LLMApi) -> httpx.AsyncClient:
+        http_client = self._http_clients.get(llm_api.url)
+        if http_client is None:
+            http2 = llm_api.http2 and find_spec("h2") is not None
+            if llm_api.http2 and not http2:
+                logger.info(f"HTTP/2 requested for {llm_api.url} but the h2 package is not installed.")
+            http_client = httpx.AsyncClient(
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=config.LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=config.LLM_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(config.LLM_REQUEST_TIMEOUT, connect=config.LLM_CONNECT_TIMEOUT),
+            )
+            self._http_clients[llm_api.url] = http_client
+        return http_client
+
+    def close(self) -> None:
+        for executor in (self._executor, self._long_running_executor):
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._long_running_executor = None
+        if self._llm_clients or self._http_clients:
+            try:
+                asyncio.run(self._close_clients())
+            except Exception as e:
+                logger.warning(f"Failed to close LLM clients: {e}")
+        if self._docker_client is not None:
+            self._docker_client.close()
+            self._docker_client = None
+
+    async def _close_clients(self) -> None:
+        llm_clients, self._llm_clients = list(self._llm_clients.values()), {}
+        http_clients, self._http_clients = list(self._http_clients.values()), {}
+        for llm_client in llm_clients:
+            await llm_client.close()
+        for http_client in http_clients:
+            await http_client.aclose()
+
+
+resource_hub = ResourceHub()
@@ -0,0 +1,76 @@
+# sandbox_kernel.py
+# Runs inside the sandbox container, so it must only use the standard library.
+import json
+import os
+import sys
+import threading
+import traceback
+
+_protocol_lock = threading.Lock()
+
+
+class FrameWriter:
+    def __init__(self, protocol, request_id: str, stream: str) -> None:
+        self.protocol = protocol
+        self.request_id = request_id
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        if text:
+            send_frame(self.protocol, {"id": self.request_id, "stream": self.stream, "data": text})
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+    def isatty(self) -> bool:
+        return False
+
+
+def send_frame(protocol, frame: dict) -> None:
+    with _protocol_lock:
+        protocol.write(json.dumps(frame) + "\n")
+        protocol.flush()
+
+
+def run_cell(protocol, namespace: dict, request: dict) -> None:
+    request_id = request["id"]
+    status = "ok"
+    sys.stdout = FrameWriter(protocol, request_id, "stdout")
+    sys.stderr = FrameWriter(protocol, request_id, "stderr")
+    try:
+        exec(compile(request["code"], f"<cell {request_id}>", "exec"), namespace)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            status = "error"
+    except BaseException:
+        traceback.print_exc()
+        status = "error"
+    finally:
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    send_frame(protocol, {"id": request_id, "status": status})
+
+
+def main() -> None:
+    # Keep the real stdout for protocol frames and point fd 1 at stderr, so output written straight
+    # to the file descriptor (e.g. by subprocesses) cannot corrupt the protocol stream.
+    protocol = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    os.dup2(2, 1)
+    requests = sys.stdin
+    sys.stdin = open(os.devnull)
+
+    namespace: dict = {"__name__": "__main__"}
+    send_frame(protocol, {"status": "ready"})
+    while True:
+        try:
+            line = requests.readline()
+        except KeyboardInterrupt:
+            continue
+        if not line:
+            break
+        if line.strip():
+            run_cell(protocol, namespace, json.loads(line))
+
+
+if __name__ == "__main__":
+    main()
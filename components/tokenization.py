@@ -0,0 +1,92 @@
+# tokenization.py
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from components.config import config
+
+if TYPE_CHECKING:
+    from transformers import PreTrainedTokenizerBase  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCounter:
+    def __init__(self, cache_size: int = config.TOKEN_COUNT_CACHE_SIZE) -> None:
+        self.cache_size = cache_size
+        self._tokenizers: dict[str, "PreTrainedTokenizerBase"] = {}
+        self._counts: OrderedDict[tuple[str, str], int] = OrderedDict()
+        self._system_message_counts: dict[tuple[str, str], int] = {}
+        self._system_messages_version = config.version
+        self._cache_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def start(self) -> None:
+        # loading a tokenizer can download it, so do that off the event loop before the first request needs it
+        threading.Thread(target=self._warm_up, name="tokenizer-warm-up", daemon=True).start()
+
+    async def load_async(self, model_name: str) -> None:
+        tokenizer_name = config.LLM_APIS[model_name].tokenizer
+        if tokenizer_name not in self._tokenizers:
+            await asyncio.get_running_loop().run_in_executor(None, self.get_tokenizer, tokenizer_name)
+
+    def _warm_up(self) -> None:
+        for tokenizer_name in sorted({llm_api.tokenizer for llm_api in config.LLM_APIS.values()}):
+            try:
+                self.get_tokenizer(tokenizer_name)
+            except Exception as e:
+                logger.warning(f"Failed to load tokenizer {tokenizer_name}: {e}")
+
+    def get_tokenizer(self, tokenizer_name: str) -> "PreTrainedTokenizerBase":
+        tokenizer = self._tokenizers.get(tokenizer_name)
+        if tokenizer is not None:
+            return tokenizer
+        with self._load_lock:
+            tokenizer = self._tokenizers.get(tokenizer_name)
+            if tokenizer is None:
+                logger.info(f"Loading tokenizer {tokenizer_name}.")
+                # transformers pulls in torch, so only import it once a tokenizer is actually needed
+                from transformers import AutoTokenizer  # type: ignore
+
+                tokenizer = AutoTokenizer.from_pretrained(tokenizer_name, use_fast=True)
+                self._tokenizers[tokenizer_name] = tokenizer
+        return tokenizer
+
+    def count(self, text: str, model_name: str) -> int:
+        tokenizer_name = config.LLM_APIS[model_name].tokenizer
+        key = (tokenizer_name, hashlib.blake2b(text.encode(), digest_size=16).hexdigest())
+        with self._cache_lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                return count
+
+        count = len(self.get_tokenizer(tokenizer_name).encode(text, add_special_tokens=True))
+        with self._cache_lock:
+            self._counts[key] = count
+            while len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return count
+
+    def count_system_message(self, model_name: str, language: str = "python") -> int:
+        tokenizer_name = config.LLM_APIS[model_name].tokenizer
+        key = (tokenizer_name, language)
+        with self._cache_lock:
+            if self._system_messages_version != config.version:
+                self._system_message_counts.clear()
+                self._system_messages_version = config.version
+            count = self._system_message_counts.get(key)
+        if count is not None:
+            return count
+
+        system_message = config.SYSTEM_MESSAGES[language]
+        count = len(self.get_tokenizer(tokenizer_name).encode(system_message, add_special_tokens=True))
+        with self._cache_lock:
+            self._system_message_counts[key] = count
+        return count
+
+
+token_counter = TokenCounter()
@@ -0,0 +1,225 @@
+# validation_service.py
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, field
+from importlib.metadata import version
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from components.code_validation import CodeValidator
+from components.config import config
+from components.resource_hub import resource_hub
+
+if TYPE_CHECKING:
+    from pylint.lint import PyLinter
+
+logger = logging.getLogger(__name__)
+
+_worker_linter: "PyLinter | None" = None
+
+
+@dataclass
+class ValidationResult:
+    is_valid: bool
+    formatted_code: str = ""
+    imports: set[str] = field(default_factory=set)
+    error_count: int = 0
+    warning_count: int = 0
+    messages: list[str] = field(default_factory=list)
+
+    def to_json(self) -> str:
+        result = asdict(self)
+        result["imports"] = sorted(self.imports)
+        return json.dumps(result)
+
+    @classmethod
+    def from_json(cls, data: str) -> "ValidationResult":
+        result = json.loads(data)
+        result["imports"] = set(result["imports"])
+        return cls(**result)
+
+
+class ValidationCache:
+    SCHEMA_VERSION = 2
+
+    def __init__(
+        self,
+        max_entries: int = config.VALIDATION_CACHE_SIZE,
+        cache_dir: Path | None = config.VALIDATION_CACHE_DIR,
+        max_disk_entries: int = config.VALIDATION_DISK_CACHE_MAX_ENTRIES,
+    ) -> None:
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self._entries: OrderedDict[str, ValidationResult] = OrderedDict()
+        self._disk_entries: OrderedDict[str, None] | None = None
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._key_prefix: str | None = None
+
+    def key(self, code: str) -> str:
+        if self._key_prefix is None:
+            # read the tool versions from package metadata so black and pylint are never imported here
+            checks = ",".join(sorted(config.PYLINT_DISABLED_CHECKS))
+            python_version = f"{sys.version_info.major}.{sys.version_info.minor}"
+            self._key_prefix = (
+                f"schema={self.SCHEMA_VERSION};black={version('black')};pylint={version('pylint')};"
+                f"disabled={checks};python={python_version};"
+            )
+        return hashlib.sha256((self._key_prefix + code).encode()).hexdigest()
+
+    def get(self, key: str) -> ValidationResult | None:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+            return result
+
+    def get_from_disk(self, key: str) -> ValidationResult | None:
+        if self.cache_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            result = ValidationResult.from_json(path.read_text())
+        except (OSError, ValueError, TypeError):
+            return None
+        with self._disk_lock:
+            self._touch_disk_entry(key)
+        try:
+            # the modification time carries the LRU order over to the next start
+            os.utime(path)
+        except OSError:
+            pass
+        self._remember(key, result)
+        return result
+
+    def put(self, key: str, result: ValidationResult) -> None:
+        self._remember(key, result)
+        if self.cache_dir is None:
+            return
+        path = self._disk_path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_suffix(".tmp")
+            temp_path.write_text(result.to_json())
+            temp_path.replace(path)
+        except OSError as e:
+            logger.warning(f"Failed to write validation cache entry {path}: {e}")
+            return
+        with self._disk_lock:
+            self._touch_disk_entry(key)
+            self._evict_from_disk()
+
+    def _remember(self, key: str, result: ValidationResult) -> None:
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _touch_disk_entry(self, key: str) -> None:
+        if self._disk_entries is None:
+            self._disk_entries = self._load_disk_entries()
+        self._disk_entries[key] = None
+        self._disk_entries.move_to_end(key)
+
+    def _load_disk_entries(self) -> OrderedDict[str, None]:
+        assert self.cache_dir is not None
+        paths = []
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                paths.append((path.stat().st_mtime, path.stem))
+            except OSError:
+                continue
+        return OrderedDict((key, None) for _mtime, key in sorted(paths))
+
+    def _evict_from_disk(self) -> None:
+        assert self._disk_entries is not None
+        while len(self._disk_entries) > self.max_disk_entries:
+            key, _ = self._disk_entries.popitem(last=False)
+            try:
+                self._disk_path(key).unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"Failed to evict validation cache entry {key}: {e}")
+
+    def _disk_path(self, key: str) -> Path:
+        assert self.cache_dir is not None
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+
+def _init_worker(disabled_checks: list[str]) -> None:
+    global _worker_linter
+    _worker_linter = CodeValidator.create_linter(disabled_checks)
+
+
+def _warm_up_worker() -> None:
+    pass
+
+
+def _validate_in_worker(code: str) -> ValidationResult:
+    analysis = CodeValidator.analyze(code)
+    if not analysis.is_valid:
+        return ValidationResult(is_valid=False)
+    formatted_code = CodeValidator.format_with_black(code)
+    linter = _worker_linter or CodeValidator.create_linter()
+    error_count, warning_count, messages = CodeValidator.lint_with(linter, formatted_code)
+    return ValidationResult(True, formatted_code, analysis.imports, error_count, warning_count, messages)
+
+
+class ValidationService:
+    def __init__(self) -> None:
+        self._executor: ProcessPoolExecutor | None = None
+        self._semaphore = asyncio.Semaphore(config.VALIDATION_MAX_CONCURRENCY)
+        self.cache = ValidationCache()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=config.VALIDATION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(config.PYLINT_DISABLED_CHECKS,),
+            )
+        return self._executor
+
+    def start(self) -> None:
+        for _ in range(config.VALIDATION_WORKERS):
+            self.executor.submit(_warm_up_worker)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def validate(self, code: str) -> ValidationResult:
+        loop = asyncio.get_running_loop()
+        key = self.cache.key(code)
+        cached_result = self.cache.get(key)
+        if cached_result is None:
+            cached_result = await loop.run_in_executor(resource_hub.executor, self.cache.get_from_disk, key)
+        if cached_result is not None:
+            return cached_result
+
+        async with self._semaphore:
+            try:
+                result = await loop.run_in_executor(self.executor, _validate_in_worker, code)
+            except BrokenProcessPool:
+                logger.warning("Validation worker pool broke, restarting it.")
+                self.close()
+                result = await loop.run_in_executor(self.executor, _validate_in_worker, code)
+
+        await loop.run_in_executor(resource_hub.executor, self.cache.put, key, result)
+        return result
+
+
+validation_service = ValidationService()
@@ -1,3 +1,4 @@
+import atexit
 import logging
 import os
 from importlib import import_module
@@ -6,6 +7,13 @@ from channels.auth import AuthMiddlewareStack  # type: ignore
 from channels.routing import ProtocolTypeRouter, URLRouter  # type: ignore
 from django.core.asgi import get_asgi_application
 
+from components.config import config
+from components.container_pool import container_pool
+from components.model_server import model_server_supervisor
+from components.resource_hub import resource_hub
+from components.tokenization import token_counter
+from components.validation_service import validation_service
+
 logging.basicConfig(level=logging.DEBUG)
 
 
@@ -22,3 +30,16 @@ application = ProtocolTypeRouter(
         ),
     }
 )
+
+# the models need the app registry that get_asgi_application() has just populated
+from api_django.persistence import message_writer  # noqa: E402
+
+config.start_watcher()
+container_pool.start()
+validation_service.start()
+token_counter.start()
+atexit.register(validation_service.close)
+atexit.register(resource_hub.close)
+atexit.register(container_pool.stop)
+atexit.register(model_server_supervisor.stop)
+atexit.register(message_writer.close)
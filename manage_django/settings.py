@@ -10,8 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
+from copy import deepcopy
 from pathlib import Path
 
+import django
+
 from components.config import config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -81,13 +85,49 @@ ASGI_APPLICATION = "manage_django.asgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    "default": {
+# config.DATABASE_BACKEND selects the default database. Each configured backend is also available under its own
+# alias, so the benchmark_database command can compare them from one process. Postgres counts as configured when it
+# is the default or its password is set in the environment.
+
+config.load_environment()
+
+if django.VERSION >= (5, 1):
+    # psycopg's connection pool replaces persistent connections; Django does not allow both at once
+    _POSTGRES_CONNECTIONS = {
+        "CONN_MAX_AGE": 0,
+        "OPTIONS": {"pool": {"min_size": config.DATABASE_POOL_MIN_SIZE, "max_size": config.DATABASE_POOL_MAX_SIZE}},
+    }
+else:
+    _POSTGRES_CONNECTIONS = {"CONN_MAX_AGE": config.DATABASE_CONN_MAX_AGE, "OPTIONS": {}}
+
+_POSTGRES_CONFIGURED = config.DATABASE_BACKEND == "postgres" or config.POSTGRES_PASSWORD_ENV in os.environ
+
+DATABASE_BACKENDS = {
+    "postgres": {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": config.POSTGRES_DATABASE,
+        "USER": config.POSTGRES_USER,
+        "PASSWORD": os.environ.get(config.POSTGRES_PASSWORD_ENV, ""),
+        "HOST": config.POSTGRES_HOST,
+        "PORT": config.POSTGRES_PORT,
+        "CONN_HEALTH_CHECKS": True,
+        **_POSTGRES_CONNECTIONS,
+    },
+    "sqlite": {
+        # WAL and the other pragmas are applied per connection in BackendDjangoConfig.ready()
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+        "CONN_MAX_AGE": config.DATABASE_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {"timeout": config.SQLITE_TIMEOUT},
+    },
 }
 
+if not _POSTGRES_CONFIGURED:
+    del DATABASE_BACKENDS["postgres"]
+
+DATABASES = {"default": deepcopy(DATABASE_BACKENDS[config.DATABASE_BACKEND]), **DATABASE_BACKENDS}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -0,0 +1,57 @@
+# test_code_block_parser.py
+import random
+
+import pytest
+
+from components.code_validation import CodeBlockParser
+
+RESPONSE = (
+    "Install the dependency first:\n"
+    "```bash\npip install requests\n```\n"
+    "Then fetch the page with `requests`:\n"
+    "```python\nimport requests\n\nprint(requests.get('https://example.com').status_code)\n```\n"
+    "The output looks like this:\n"
+    "```\n200\n```\n"
+    "That's it."
+)
+EXPECTED_BLOCKS = [
+    ("bash", "pip install requests"),
+    ("python", "import requests\n\nprint(requests.get('https://example.com').status_code)"),
+    (None, "200"),
+]
+
+
+def _feed_chunks(chunks: list[str]) -> list[tuple[str | None, str]]:
+    parser = CodeBlockParser()
+    code_blocks = []
+    for chunk in chunks:
+        code_blocks.extend(parser.feed(chunk))
+    return code_blocks
+
+
+def test_whole_response_yields_every_block() -> None:
+    assert _feed_chunks([RESPONSE]) == EXPECTED_BLOCKS
+
+
+def test_single_character_chunks_yield_every_block() -> None:
+    assert _feed_chunks(list(RESPONSE)) == EXPECTED_BLOCKS
+
+
+@pytest.mark.parametrize("split", range(1, len(RESPONSE)))
+def test_any_two_way_split_yields_every_block(split: int) -> None:
+    assert _feed_chunks([RESPONSE[:split], RESPONSE[split:]]) == EXPECTED_BLOCKS
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_random_chunk_boundaries_yield_every_block(seed: int) -> None:
+    rng = random.Random(seed)
+    boundaries = sorted(rng.sample(range(1, len(RESPONSE)), rng.randint(1, 40)))
+    chunks = [RESPONSE[start:end] for start, end in zip([0, *boundaries], [*boundaries, len(RESPONSE)])]
+    assert _feed_chunks(chunks) == EXPECTED_BLOCKS
+
+
+def test_block_is_returned_once_its_closing_fence_arrives() -> None:
+    parser = CodeBlockParser()
+    assert parser.feed("```python\nprint(1)\n`") == []
+    assert parser.feed("`") == []
+    assert parser.feed("`\nmore text") == [("python", "print(1)")]
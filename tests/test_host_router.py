@@ -0,0 +1,112 @@
+# test_host_router.py
+import asyncio
+import json
+import threading
+from contextlib import AsyncExitStack, aclosing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import AsyncIterator, Iterator
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from components.host_router import HostRouter  # noqa: E402
+
+MODEL_NAME = "deepseek-coder-33b"
+
+
+class StubModelsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        body = json.dumps({"data": [{"id": f"/models/{MODEL_NAME}.Q4_K_M.gguf"}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def stub_servers() -> Iterator[list[ThreadingHTTPServer]]:
+    servers = [ThreadingHTTPServer(("127.0.0.1", 0), StubModelsHandler) for _ in range(2)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _router(tmp_path: Path, servers: list[ThreadingHTTPServer], slots: list[int]) -> HostRouter:
+    hostnames_file = tmp_path / "hostnames"
+    hostnames_file.write_text(
+        "\n".join(f"127.0.0.1:{server.server_address[1]}:{count}" for server, count in zip(servers, slots))
+    )
+    return HostRouter(hostnames_file)
+
+
+def test_leases_fill_free_slots_and_wait_when_all_are_busy(
+    tmp_path: Path, stub_servers: list[ThreadingHTTPServer]
+) -> None:
+    router = _router(tmp_path, stub_servers, [1, 2])
+
+    async def run() -> None:
+        async with AsyncExitStack() as stack:
+            urls = [await stack.enter_async_context(router.lease(MODEL_NAME)) for _ in range(3)]
+            assert urls.count(router.hosts[0].url) == 1
+            assert urls.count(router.hosts[1].url) == 2
+            assert router.metrics()["inference_slots_in_use"] == 3
+
+            async def lease_one_more() -> str | None:
+                async with router.lease(MODEL_NAME) as url:
+                    return url
+
+            waiting = asyncio.ensure_future(lease_one_more())
+            await asyncio.sleep(0.1)
+            assert not waiting.done()
+
+        assert await asyncio.wait_for(waiting, 1) in {host.url for host in router.hosts}
+        assert router.metrics()["inference_slots_in_use"] == 0
+
+    asyncio.run(run())
+
+
+def test_abandoned_stream_releases_its_slot(tmp_path: Path, stub_servers: list[ThreadingHTTPServer]) -> None:
+    router = _router(tmp_path, stub_servers, [1, 1])
+
+    async def stream() -> AsyncIterator[str | None]:
+        async with router.lease(MODEL_NAME) as url:
+            while True:
+                yield url
+
+    async def run() -> None:
+        async with aclosing(stream()) as chunks:
+            async for _url in chunks:
+                assert router.metrics()["inference_slots_in_use"] == 1
+                break
+        assert router.metrics()["inference_slots_in_use"] == 0
+
+    asyncio.run(run())
+
+
+def test_failed_host_is_skipped_until_it_recovers(tmp_path: Path, stub_servers: list[ThreadingHTTPServer]) -> None:
+    router = _router(tmp_path, stub_servers, [1, 1])
+
+    async def run() -> None:
+        async with router.lease(MODEL_NAME) as url:
+            assert await router.mark_unhealthy(url)
+        failed_url = url
+        assert not await router.mark_unhealthy("http://127.0.0.1:1/v1")
+
+        for _ in range(3):
+            async with router.lease(MODEL_NAME) as url:
+                assert url != failed_url
+        assert router.metrics()["inference_hosts_healthy"] == 1
+
+        await router.refresh()
+        assert router.metrics()["inference_hosts_healthy"] == 2
+
+    asyncio.run(run())
@@ -0,0 +1,51 @@
+# test_import_time.py
+import subprocess
+import sys
+from importlib.util import find_spec
+from pathlib import Path
+
+import pytest
+
+PROJECT_DIR = Path(__file__).parent.parent
+HEAVY_MODULES = {"transformers", "torch", "pylint", "black", "stdlib_list", "dotenv"}
+IMPORT_TIME_BUDGET_US = 1_500_000
+
+
+def _import_times(module: str) -> dict[str, int]:
+    # -X importtime reports "self | cumulative | name" in microseconds on stderr, one line per imported module
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_time, cumulative_time, name = line.removeprefix("import time:").split("|")
+        import_times[name.strip()] = int(cumulative_time)
+    return import_times
+
+
+@pytest.mark.parametrize(
+    ("module", "requirements"),
+    [
+        ("components.config", []),
+        ("components.code_validation", []),
+        ("components.tokenization", []),
+        ("components.package_index", []),
+        ("components.lang_model_service", ["openai", "httpx", "docker"]),
+    ],
+)
+def test_import_stays_within_budget(module: str, requirements: list[str]) -> None:
+    missing = [requirement for requirement in requirements if find_spec(requirement) is None]
+    if missing:
+        pytest.skip(f"{', '.join(missing)} not installed")
+
+    import_times = _import_times(module)
+
+    loaded_heavy_modules = HEAVY_MODULES & {name.split(".")[0] for name in import_times}
+    assert not loaded_heavy_modules, f"{module} imports {sorted(loaded_heavy_modules)} at load time"
+    assert import_times[module] < IMPORT_TIME_BUDGET_US